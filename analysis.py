@@ -8,22 +8,81 @@ Note:
     implemented due to time shortage. :(
 """
 
-import pandas as pd
+import time
 import numpy as np
+import pandas as pd
 import sys
+import schema
+from download import DataDownloader
+
+# Target pandas data types of columns
+COLUMN_TYPES = schema.pandas_types()
+
+
+def _remove_blank_categories(values: pd.Series) -> pd.Series:
+    """ Replaces blank values of categorical series with NaN, only categories are searched, not every value.
+
+        Parameters:
+            values : pandas.Series
+                Categorical series.
+
+        Returns:
+            pandas.Series
+                Categorical series without blank categories.
+    """
+    blank = values.cat.categories.astype(str).str.fullmatch(r"\s*")
+    return values.cat.remove_categories(values.cat.categories[blank])
+
+
+def _as_pandas(name: str, values) -> pd.Series:
+    """ Converts values of column to pandas.Series with data type from schema module, null values of schema (and
+    invalid values) are replaced with pandas.NA (NaN, NaT).
+
+        Parameters:
+            name : str
+                Column name.
+            values : numpy.ndarray or pandas.Categorical or pandas.Series
+                Values of column, typed (from DataDownloader.get_dict method) or strings.
+
+        Returns:
+            pandas.Series
+                Converted values (with index of values, if values is pandas.Series).
+    """
+    column = schema.COLUMNS_BY_NAME[name]
+
+    if column.parser in ["str", "region"]:
+        if isinstance(values, np.ndarray) and values.dtype.kind == "S":
+            values = values.astype(str)
+        return _remove_blank_categories(pd.Series(values, dtype="category"))
+
+    if column.parser == "date":
+        return pd.to_datetime(pd.Series(values), errors="coerce").astype(column.pandas)
+
+    # Strings are parsed same as by DataDownloader parser (decimal comma, times in HHMM format)
+    index = values.index if isinstance(values, pd.Series) else None
+    values = pd.Series(schema.as_numbers(name, pd.Series(values)), index=index)
+    invalid = values.isna() | (values == column.null)
+
+    if column.parser == "float":
+        return values.astype(column.pandas).mask(invalid)
+
+    # Integer columns go through nullable integer data type, also if they are categorical (r, s)
+    nullable = ("UInt" if column.dtype.kind == "u" else "Int") + str(column.dtype.itemsize * 8)
+    return values.mask(invalid).astype(nullable).astype(column.pandas)
 
 
 def get_dataframe(filename: str, verbose: bool = False) -> pd.DataFrame:
     """ Loads data and transform them to pandas.DataFrame with correct data types.
 
-    If error occurs during opening a file, function exits script.
+    Data types are taken from COLUMN_TYPES (schema module), empty, invalid and null values become pandas.NA (NaN,
+    NaT), same as in load_dataframe function. If error occurs during opening a file, function exits script.
 
         Parameters:
             filename : str
                 Path to file with data.
             verbose : bool
                 If true, on stdout will be printed total size in MB of precessed data before and after converting data
-                types to pandas.
+                types to pandas and time of conversion.
 
         Returns:
             pandas.DataFrame
@@ -36,21 +95,65 @@ def get_dataframe(filename: str, verbose: bool = False) -> pd.DataFrame:
         exit(-1)
     else:
         if verbose:
-            print(f"orig_size={sys.getsizeof(df)/1_048_576:.1f} MB")
+            start = time.perf_counter()
+            print(f"orig_size={df.memory_usage(deep=True).sum() / 1_048_576:.1f} MB")
 
         for column in df.columns:
-            df[column].replace(r"(^\s*$)", np.NAN, regex=True, inplace=True)
-            if column in ["p36", "p37", "weekday(p2a)", "p2b", "p6", "p7", "p8", "p9", "p10", "p11", "p12", "p13a",
-                          "p13b", "p13c", "p14", "p15", "p16", "p17", "p18", "p19", "p20", "p21", "p22", "p23", "p24",
-                          "p27", "p28", "p34", "p35", "p39", "p44", "p45a", "p47", "p48a", "p49", "p50a", "p50b", "p51",
-                          "p52", "p53", "p55a", "p57", "p58", "a", "b", "d", "e", "f", "g", "j", "p5a"]:
-                df[column] = pd.to_numeric(df[column], downcast='signed')
-            elif column in ["k", "l", "n", "o", "p", "q", "r", "s", "t", "h", "i"]:
-                df[column] = df[column].astype('category')
-            elif column == "p2a":
-                df["date"] = df[column].astype("datetime64[M]")
+            if column in COLUMN_TYPES:
+                df[column] = _as_pandas(column, df[column])
+
+        if "p2a" in df.columns:
+            df["date"] = df["p2a"].dt.to_period("M").dt.to_timestamp()
 
         if verbose:
-            print(f"new_size={sys.getsizeof(df)/1_048_576:.1f} MB")
+            print(f"new_size={df.memory_usage(deep=True).sum() / 1_048_576:.1f} MB")
+            print(f"time={time.perf_counter() - start:.2f} s")
 
         return df
+
+
+def load_dataframe(downloader: DataDownloader = None, regions: list = None, columns: list = None,
+                   verbose: bool = False, where: dict = None) -> pd.DataFrame:
+    """ Creates pandas.DataFrame straight from typed data of DataDownloader.get_dict method.
+
+    Data types are taken from COLUMN_TYPES (schema module), values are only cast, no strings are parsed. Null values
+    of schema become pandas.NA (NaN, NaT), same as in get_dataframe function.
+
+        Parameters:
+            downloader : DataDownloader
+                Source of data, if None, DataDownloader in lazy mode is created.
+            regions : list of str
+                Regions, see DataDownloader.get_dict method.
+            columns : list of str
+                Columns, see DataDownloader.get_dict method.
+            verbose : bool
+                If true, on stdout will be printed total size in MB of data before and after converting data types to
+                pandas and time of loading and conversion.
+            where : dict
+                Condition for rows, see DataDownloader.get_dict method.
+
+        Returns:
+            pandas.DataFrame
+                Data frame with data.
+    """
+    if downloader is None:
+        downloader = DataDownloader(lazy=True)
+
+    start = time.perf_counter()
+    data = downloader.get_dict(regions, columns=columns, where=where)
+
+    if verbose:
+        print(f"orig_size={sum(values.nbytes for values in data.values()) / 1_048_576:.1f} MB")
+        print(f"load_time={time.perf_counter() - start:.2f} s")
+        start = time.perf_counter()
+
+    df = pd.DataFrame({column: _as_pandas(column, values) for column, values in data.items()})
+
+    if "p2a" in df.columns:
+        df["date"] = df["p2a"].dt.to_period("M").dt.to_timestamp()
+
+    if verbose:
+        print(f"new_size={df.memory_usage(deep=True).sum() / 1_048_576:.1f} MB")
+        print(f"time={time.perf_counter() - start:.2f} s")
+
+    return df
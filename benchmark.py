@@ -0,0 +1,1024 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Script containing benchmarks of data processing made with DataDownloader class.
+
+Can be imported as module, or run as main script.
+If run as main script, runs all the benchmarks on downloaded data, takes optional arguments:
+    --workers, maximal number of worker processes used for parsing, default=number of CPU cores,
+    --rows, number of rows of synthetic data, default=5000000,
+    --cluster-rows, numbers of points of synthetic data for clustering, default=10000 50000 200000.
+With --check argument, runs offline correctness checks (see check_duplicates, check_engines, check_download and
+check_tiles) instead.
+With --suite argument, runs offline benchmark of processing stages on synthetic data instead (see bench_stages), takes
+optional arguments:
+    --scales, numbers of rows of synthetic data, default=10000 100000 1000000,
+    --repeats, number of timed runs of each stage, default=3,
+    --folder, path to folder for synthetic data, default=temporary folder,
+    --output, path to JSON file, where results are saved, default=None,
+    --compare, path to JSON file with results of previous run, regressions are reported and the script exits with
+        error,
+    --tolerance, allowed relative growth of time and memory against compared run, default=0.1.
+
+Out of non-built-in libraries this script uses numpy, pandas, matplotlib (through get_stat module) and scikit-learn
+(through geo module, imported only by bench_cluster)
+"""
+
+import concurrent.futures
+import csv
+import datetime
+import hashlib
+import http.server
+import io
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+import matplotlib
+import numpy as np
+import pandas as pd
+import schema
+import get_stat
+from download import DataDownloader
+from metrics import Metrics
+
+
+def bench_workers(max_workers: int = None, regions: list = None, folder: str = "data"):
+    """Measures time of cold parsing (without cache) of provided regions for 1 to max_workers worker processes and
+    prints results to stdout.
+
+    Results of parallel parsing are compared with serial parsing and must be identical.
+
+    Parameters:
+        max_workers : int, optional, default: None
+            Maximal number of worker processes. If None, number of CPU cores is used.
+        regions : list of str, optional, default: None
+            Parsed regions, if None, all the regions are parsed.
+        folder : str
+            Path to folder with downloaded data.
+
+    Returns:
+        dict of (int, float)
+            Number of workers : time of parsing in seconds.
+    """
+    if not max_workers:
+        max_workers = os.cpu_count()
+
+    results = {}
+    reference = None
+
+    for workers in range(1, max_workers + 1):
+        downloader = DataDownloader(folder=folder, cache_filename="bench_workers_{}", lazy=True)
+
+        start = time.perf_counter()
+        data = downloader.get_dict(regions, workers)
+        results[workers] = time.perf_counter() - start
+
+        # Remove cache, so next run is cold again
+        for region in regions or list(DataDownloader.regions.keys()):
+            shutil.rmtree(folder + os.path.sep + re.sub('{}', region, downloader.cache_filename, 1))
+
+        if reference is None:
+            reference = data
+        else:
+            for key, values in reference.items():
+                values, other = np.asarray(values), np.asarray(data[key])
+                if not np.array_equal(values, other, equal_nan=values.dtype.kind in 'fmM'):
+                    raise AssertionError('Parallel parsing result differs from serial parsing in column ' + key)
+
+        print(f'workers={workers:<3} time={results[workers]:8.2f} s  speedup={results[1] / results[workers]:5.2f}x')
+
+    return results
+
+
+def _merge_rss(regions: list, folder: str):
+    """Joins cached regions by get_dict method and measures growth of peak resident memory of process. Used as task
+    for fresh worker process in bench_merge_memory function, so memory of previous work isn't counted.
+
+    Parameters:
+        regions : list of str
+            Joined regions.
+        folder : str
+            Path to folder with downloaded data.
+
+    Returns:
+        tuple of (int, int)
+            Size of joined data in bytes, growth of peak resident memory in bytes.
+    """
+    downloader = DataDownloader(folder=folder, lazy=True)
+    baseline = Metrics.peak_rss()
+    data = downloader.get_dict(regions)
+
+    return sum(values.nbytes for values in data.values()), Metrics.peak_rss() - baseline
+
+
+def bench_merge_memory(regions: list = None, folder: str = "data", max_ratio: float = 1.5):
+    """Measures peak memory while joining cached regions in get_dict method and compares it with size of the joined
+    data, prints results to stdout.
+
+    Peak resident memory (RSS) is measured in fresh process, it includes pages of memory mapped cache, which are read
+    while joining. Peak of memory allocated by Python and numpy is measured by tracemalloc, it doesn't include mapped
+    pages. Joined columns are preallocated, memory over size of joined data is mostly hash table of accident IDs used
+    for removing duplicates. On 200000 synthetic rows (see make_synthetic_data) RSS is 1.37x size of joined data, it
+    was 1.48x before codes of dictionary encoded columns were kept memory mapped.
+
+    Parameters:
+        regions : list of str, optional, default: None
+            Joined regions, if None, all the regions are joined.
+        folder : str
+            Path to folder with downloaded data.
+        max_ratio : float
+            Allowed ratio of peak resident memory to size of joined data, greater ratio raises AssertionError.
+
+    Returns:
+        tuple of (int, int, int)
+            Size of joined data in bytes, peak of resident memory in bytes, peak of allocated memory in bytes.
+    """
+    # Make sure regions are cached, so only loading and joining is measured
+    DataDownloader(folder=folder, lazy=True).get_dict(regions)
+
+    if Metrics.peak_rss() is None:
+        rss = None
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            rss = executor.submit(_merge_rss, regions, folder).result()[1]
+
+    downloader = DataDownloader(folder=folder, lazy=True)
+    tracemalloc.start()
+    data = downloader.get_dict(regions)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    size = sum(values.nbytes for values in data.values())
+    print(f'data={size / 1_048_576:.1f} MB  rss={rss / 1_048_576 if rss else float("nan"):.1f} MB  '
+          f'allocated={peak / 1_048_576:.1f} MB  rss ratio={rss / size if rss else float("nan"):.2f}x  '
+          f'allocated ratio={peak / size:.2f}x')
+
+    if rss is not None and rss > max_ratio * size:
+        raise AssertionError(f'Peak resident memory of joining is {rss / size:.2f}x size of data, allowed is '
+                             f'{max_ratio:.2f}x')
+
+    return size, rss, peak
+
+
+def bench_schema_memory(regions: list = None, folder: str = "data"):
+    """Measures memory per row of each column with data types of schema module and compares it with the narrowest
+    data type, which could hold actual values of the column, prints results to stdout.
+
+    Dictionary encoded columns (pandas.Categorical) are measured as their codes plus their categories spread over all
+    the rows, the narrowest data type is the narrowest integer type, which could hold all the codes.
+
+    Parameters:
+        regions : list of str, optional, default: None
+            Measured regions, if None, all the regions are measured.
+        folder : str
+            Path to folder with downloaded data.
+
+    Returns:
+        tuple of (float, float)
+            Bytes per row with schema data types, bytes per row with the narrowest data types.
+    """
+    data = DataDownloader(folder=folder, lazy=True).get_dict(regions)
+
+    schema_size, narrowest_size = 0, 0
+    for column in schema.COLUMNS:
+        values = data[column.name]
+        # Categories are shared by all the rows
+        shared = values.categories.nbytes if isinstance(values, pd.Categorical) else 0
+        if isinstance(values, pd.Categorical):
+            values = values.codes
+
+        if values.dtype.kind in 'iu' and values.size:
+            narrowest = next(np.dtype(dtype) for dtype in [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32,
+                                                           np.int64, np.uint64]
+                             if np.iinfo(dtype).min <= values.min() and values.max() <= np.iinfo(dtype).max)
+        elif values.dtype.kind in 'SU' and values.size:
+            narrowest = np.dtype(values.dtype.kind + str(max(np.char.str_len(values).max(), 1)))
+        else:
+            narrowest = values.dtype
+
+        size = values.dtype.itemsize + shared / max(values.size, 1)
+        schema_size += size
+        narrowest_size += narrowest.itemsize + shared / max(values.size, 1)
+        print(f'{column.name:<14} schema={str(values.dtype):<14} {size:>7.2f} B/row  '
+              f'narrowest={str(narrowest):<14} {narrowest.itemsize:>4} B/row')
+
+    print(f'total          schema={schema_size:.2f} B/row  narrowest={narrowest_size:.2f} B/row')
+
+    return schema_size, narrowest_size
+
+
+def bench_crosstab(rows: int = 5_000_000, seed: int = 0):
+    """Measures time of counting accidents for each pair of p24 and region on synthetic data with get_stat.crosstab
+    and with nested loop of per cell comparisons, which was used by get_stat.plot_stat before, prints results to
+    stdout.
+
+    Results of both methods must be identical.
+
+    Parameters:
+        rows : int
+            Number of rows of synthetic data.
+        seed : int
+            Seed of random generator.
+
+    Returns:
+        tuple of (float, float)
+            Time of nested loop in seconds, time of crosstab in seconds.
+    """
+    generator = np.random.default_rng(seed)
+    regions = list(DataDownloader.regions.keys())
+    data = {
+        "p24": generator.integers(0, 7, rows).astype(np.uint8),
+        "region": np.array(regions, "S3")[generator.integers(0, len(regions), rows)],
+    }
+
+    start = time.perf_counter()
+    loop = np.zeros((6, len(regions)), np.int64)
+    for i in range(6):
+        for j in range(len(regions)):
+            loop[i, j] = np.count_nonzero(np.logical_and(data["p24"] == i, data["region"] == regions[j].encode()))
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    counts = get_stat.crosstab(data, "p24", "region", np.arange(6), regions)[0]
+    crosstab_time = time.perf_counter() - start
+
+    if not np.array_equal(loop, counts):
+        raise AssertionError('crosstab result differs from nested loop result')
+
+    print(f'rows={rows}  loop={loop_time:.2f} s  crosstab={crosstab_time:.2f} s  '
+          f'speedup={loop_time / crosstab_time:.1f}x')
+
+    return loop_time, crosstab_time
+
+
+def bench_cluster(sizes: list = None, seed: int = 0, workers: int = 1):
+    """Measures time and peak of allocated memory of clustering synthetic accident positions by MiniBatchKMeans (25
+    clusters, used by geo.plot_cluster) and by DBSCAN with KD-tree index, for growing number of points, prints results
+    to stdout.
+
+    Points are in 14 regions, each region has hotspots (normally distributed points) and uniform background.
+
+    Parameters:
+        sizes : list of int, optional, default: None
+            Numbers of points. If None, 10000, 50000 and 200000 points are used.
+        seed : int
+            Seed of random generator.
+        workers : int
+            Number of worker processes of geo.cluster_geo function.
+
+    Returns:
+        dict of (tuple, tuple of (float, int))
+            (method, number of points) : (time in seconds, peak of allocated memory in bytes).
+    """
+    # geo module needs geographic libraries, which aren't needed by other benchmarks
+    import geo
+
+    generator = np.random.default_rng(seed)
+    regions = list(DataDownloader.regions.keys())
+    results = {}
+
+    for size in sizes or [10_000, 50_000, 200_000]:
+        region = generator.integers(0, len(regions), size)
+        # Region is 100 km square, 60 % of points are in 40 hotspots with 200 m deviation
+        hotspot = generator.integers(0, 40, size)
+        centers = generator.uniform(0, 100_000, (len(regions), 40, 2))
+        coords = np.where(generator.random((size, 1)) < 0.6,
+                          centers[region, hotspot] + generator.normal(0, 200, (size, 2)),
+                          generator.uniform(0, 100_000, (size, 2)))
+        coords += np.column_stack([region * 100_000, np.zeros(size)])
+        gdf = pd.DataFrame({"x": coords[:, 0], "y": coords[:, 1], "region": np.array(regions)[region]})
+
+        for method in ["kmeans", "dbscan"]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            labels = geo.cluster_geo(gdf, method, workers)
+            results[(method, size)] = (time.perf_counter() - start, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+            print(f'method={method:<7} points={size:<8} time={results[(method, size)][0]:7.2f} s  '
+                  f'peak={results[(method, size)][1] / 1_048_576:7.1f} MB  clusters={labels.max() + 1}')
+
+    return results
+
+
+# Ranges (low, high exclusive) of synthetic integer and float values, other columns use defaults of make_synthetic_data
+_SYNTHETIC_RANGES = {
+    "p36": (0, 9),
+    "p37": (1, 100_000),
+    "p9": (1, 3),
+    "p13a": (0, 3),
+    "p13b": (0, 4),
+    "p13c": (0, 6),
+    "p14": (0, 5_000),
+    "p24": (0, 6),
+    "p53": (0, 20_000),
+    "r": (1, 1_000_000),
+    "s": (1, 1_000_000),
+    # S-JTSK (EPSG:5514) extent of Czech republic
+    "d": (-900_000, -430_000),
+    "e": (-1_230_000, -935_000),
+    "f": (12, 19),
+    "g": (48, 51),
+}
+
+# Values of synthetic string columns, with Czech characters to exercise cp1250 encoding
+_SYNTHETIC_WORDS = ["", "Praha", "Brno", "Ostrava", "Plzeň", "Liberec", "Olomouc", "České Budějovice", "Hradec Králové",
+                    "Ústí nad Labem", "Pardubice", "Zlín", "Havířov", "Kladno", "Frýdek-Místek", "Karviná", "Jihlava",
+                    "Děčín", "Třebíč", "Žďár nad Sázavou"]
+
+
+def make_synthetic_data(folder: str, rows: int, archives: int = 2, seed: int = 0, duplicates: float = 0.001):
+    """Generates synthetic data in format of police department website, so DataDownloader can parse them offline.
+
+    Folder gets archives ZIP files, each with CSV file of every region (cp1250, ';' delimited, quoted values, all the
+    CSV headers of schema module), and index file with their paths, which is used by DataDownloader in lazy mode
+    without connecting to server. Rows are spread over regions randomly and over archives in order. Values are random
+    with realistic ranges, some of them are empty or invalid (times, coordinates) as in real data, and fraction of
+    accident IDs (p1) is repeated, so duplicates are removed by DataDownloader.get_dict method.
+
+    Parameters:
+        folder : str
+            Path to folder, created if doesn't exist.
+        rows : int
+            Total number of rows.
+        archives : int
+            Number of ZIP files.
+        seed : int
+            Seed of random generator, same seed gives same files.
+        duplicates : float
+            Fraction of rows with accident ID of other row.
+
+    Returns:
+        list of str
+            Paths of archives, as stored in index file.
+    """
+    generator = np.random.default_rng(seed)
+    frame = {}
+
+    for column in schema.COLUMNS:
+        if column.parser == "int":
+            if column.name in _SYNTHETIC_RANGES:
+                low, high = _SYNTHETIC_RANGES[column.name]
+            elif column.dtype.itemsize == 1:
+                low, high = 0, 10
+            else:
+                low, high = 0, 1_000
+            values = pd.array(generator.integers(low, high, rows), "Int64")
+            # Signed columns (except IDs and damage amounts) can be empty in CSV
+            if column.dtype.kind == "i" and column.name not in ["p1", "p14", "p53"]:
+                values[generator.random(rows) < 0.05] = pd.NA
+        elif column.parser == "float":
+            low, high = _SYNTHETIC_RANGES.get(column.name, (0, 1_000_000))
+            values = generator.uniform(low, high, rows)
+            values[generator.random(rows) < 0.02] = np.nan
+        elif column.parser == "str":
+            values = pd.Categorical.from_codes(generator.integers(0, len(_SYNTHETIC_WORDS), rows), _SYNTHETIC_WORDS)
+        elif column.parser == "time":
+            values = generator.integers(0, 24, rows) * 100 + generator.integers(0, 60, rows)
+            # Unknown time is written as hour 25 in real data
+            values[generator.random(rows) < 0.01] = 2560
+        elif column.parser == "date":
+            dates = np.datetime64("2016-01-01") + generator.integers(0, 5 * 365, rows)
+            values = np.datetime_as_string(dates, unit="D")
+        else:
+            continue
+
+        frame[column.name] = values
+
+    frame["p1"] = np.arange(rows, dtype=np.int64) + 10_000_000_000
+    repeated = generator.random(rows) < duplicates
+    frame["p1"][repeated] = generator.choice(frame["p1"], np.count_nonzero(repeated))
+    frame["p12"] = generator.integers(1, 7, rows) * 100 + generator.integers(1, 17, rows)
+    frame["weekday(p2a)"] = (frame["p2a"].astype("datetime64[D]").astype(np.int64) + 4) % 7
+    frame = pd.DataFrame(frame)
+
+    # Rows are sorted by archive and region, so CSV file of each pair is one slice
+    regions = np.array(list(DataDownloader.regions.values()))
+    region = generator.integers(0, len(regions), rows)
+    archive = np.arange(rows) * archives // max(rows, 1)
+    key = archive * len(regions) + region
+    order = np.argsort(key, kind="stable")
+    frame = frame.iloc[order]
+    bounds = np.searchsorted(key[order], np.arange(archives * len(regions) + 1))
+
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+
+    for i in range(archives):
+        paths.append(f'data/synthetic-{i}.zip')
+        with zipfile.ZipFile(folder + os.path.sep + paths[-1][5:], 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for j, code in enumerate(regions):
+                part = frame.iloc[bounds[i * len(regions) + j]:bounds[i * len(regions) + j + 1]]
+                zipf.writestr(code + '.csv', part.to_csv(sep=';', header=False, index=False, quoting=csv.QUOTE_ALL,
+                                                         lineterminator='\r\n', decimal=',',
+                                                         float_format='%.3f').encode('cp1250'))
+
+    with open(folder + os.path.sep + 'index.json', 'w') as f:
+        json.dump({"archives": {}, "paths": paths}, f, indent=1)
+
+    return paths
+
+
+def check_duplicates(rows: int = 20_000, seed: int = 0, folder: str = None):
+    """Checks removing of duplicate accident IDs (p1) by get_dict and iter_batches methods on synthetic data (see
+    make_synthetic_data function) with 20 % of rows repeating IDs of other rows, so the same ID is in more regions and
+    archives. Results are compared with pandas.DataFrame.drop_duplicates of rows parsed without removing duplicates,
+    for keep="first" and keep="last", for regions in both orders and with condition (applied after removing duplicates),
+    prints results to stdout.
+
+    If any result differs, AssertionError is raised.
+
+    Parameters:
+        rows : int
+            Number of rows of synthetic data.
+        seed : int
+            Seed of random generator of synthetic data.
+        folder : str, optional, default: None
+            Path to folder for synthetic data. If None, temporary folder is used and removed afterwards.
+    """
+    temporary = folder is None
+    if temporary:
+        folder = tempfile.mkdtemp(prefix="izv-check-")
+
+    columns = ["p1", "p36", "p2a", "region"]
+    where = {"p36": {0, 1}}
+
+    try:
+        make_synthetic_data(folder, rows, seed=seed, duplicates=0.2)
+        downloader = DataDownloader(folder=folder, lazy=True)
+        parsed = downloader.parse_regions_data(list(DataDownloader.regions.keys()))
+
+        for regions in [list(DataDownloader.regions.keys()), list(DataDownloader.regions.keys())[::-1]]:
+            frame = pd.concat([pd.DataFrame({key: parsed[region][key] for key in columns}) for region in regions],
+                              ignore_index=True)
+
+            for keep in ["first", "last"]:
+                expected = frame.drop_duplicates("p1", keep=keep)
+                cases = [("get_dict", expected, downloader.get_dict(regions, columns=columns, keep=keep)),
+                         ("get_dict where", expected[expected["p36"].isin(where["p36"])],
+                          downloader.get_dict(regions, columns=columns, where=where, keep=keep))]
+                if keep == "first":
+                    batches = list(downloader.iter_batches(regions, 997, columns, where))
+                    cases.append(("iter_batches where", expected[expected["p36"].isin(where["p36"])],
+                                  {key: np.concatenate([batch[key] for batch in batches]) for key in columns}))
+
+                for name, reference, data in cases:
+                    for key in columns:
+                        if not np.array_equal(reference[key].to_numpy(), data[key]):
+                            raise AssertionError(f'{name} (keep={keep}, regions from {regions[0]}) differs from '
+                                                 f'drop_duplicates in column {key}')
+                    print(f'{name:<20} keep={keep:<6} regions from {regions[0]}  rows={len(reference.index)}  ok')
+    finally:
+        if temporary:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def check_engines(rows: int = 100_000, seed: int = 0, folder: str = None, max_ratio: float = 0.5):
+    """Checks, that "numpy" parser engine of DataDownloader.parse_region_data method gives same data as "python"
+    reference engine for each region of synthetic data (see make_synthetic_data function), with empty and invalid
+    values, and compares time of both engines, prints results to stdout.
+
+    If any column differs (in values, data type or categories), or "numpy" engine takes more than max_ratio of time of
+    "python" engine in total, AssertionError is raised.
+
+    Parameters:
+        rows : int
+            Number of rows of synthetic data.
+        seed : int
+            Seed of random generator of synthetic data.
+        folder : str, optional, default: None
+            Path to folder for synthetic data. If None, temporary folder is used and removed afterwards.
+        max_ratio : float
+            Maximal ratio of time of "numpy" engine to time of "python" engine.
+    """
+    temporary = folder is None
+    if temporary:
+        folder = tempfile.mkdtemp(prefix="izv-check-")
+
+    try:
+        make_synthetic_data(folder, rows, seed=seed)
+        downloader = DataDownloader(folder=folder, lazy=True)
+        times = {engine: 0.0 for engine in DataDownloader.engines}
+
+        for region in DataDownloader.regions:
+            data = {}
+            for engine in DataDownloader.engines:
+                start = time.perf_counter()
+                data[engine] = downloader.parse_region_data(region, engine)
+                times[engine] += time.perf_counter() - start
+
+            for key, reference in data["python"].items():
+                values = data["numpy"][key]
+                if isinstance(reference, pd.Categorical):
+                    equal = (isinstance(values, pd.Categorical) and np.array_equal(values.codes, reference.codes)
+                             and list(values.categories) == list(reference.categories))
+                else:
+                    equal = values.dtype == reference.dtype and np.array_equal(values, reference,
+                                                                               equal_nan=reference.dtype.kind == "f")
+                if not equal:
+                    raise AssertionError(f'numpy engine differs from python engine in column {key} of {region}')
+
+        ratio = times["numpy"] / times["python"]
+        print(f'{"engines":<24} rows={rows}  numpy={times["numpy"]:.2f}s  python={times["python"]:.2f}s  '
+              f'ratio={ratio:.2f}  ok')
+        if ratio > max_ratio:
+            raise AssertionError(f'numpy engine takes {ratio:.2f} of time of python engine, limit is {max_ratio}')
+    finally:
+        if temporary:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+class _ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    """Handler of local http server standing in for police department server in check_download function. Serves
+    server.files (file name : bytes) under '/data/', with ETag, conditional (If-None-Match) and Range (If-Range)
+    requests, files in server.failing are answered with 500.
+    """
+
+    def do_GET(self):
+        name = self.path.rpartition('/')[2]
+        self.server.requests.append((name, self.headers.get('Range')))
+
+        if name in self.server.failing or name not in self.server.files:
+            self.send_error(500 if name in self.server.failing else 404)
+            return
+
+        content = self.server.files[name]
+        etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        status, start = 200, 0
+        if self.headers.get('Range') and self.headers.get('If-Range') == etag:
+            start = int(self.headers['Range'][6:-1])
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(content)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content) - start))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{len(content) - 1}/{len(content)}')
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def check_download(rows: int = 2_000, seed: int = 0):
+    """Checks downloading by DataDownloader.download_data method against local http server serving synthetic data (see
+    make_synthetic_data function), prints results to stdout. Checked cases are:
+        download of missing files,
+        revalidation of unchanged files (304 Not Modified),
+        resuming of interrupted download (206 Partial Content),
+        complete '.part' file, which wasn't renamed (416 Range Not Satisfiable), and '.part' file longer than file on
+            server (416, downloaded again),
+        failing download of one file, headers of other files have to be saved in index file.
+
+    If any downloaded file differs from served file, or files are downloaded more than needed, AssertionError is
+    raised.
+
+    Parameters:
+        rows : int
+            Number of rows of synthetic data.
+        seed : int
+            Seed of random generator of synthetic data.
+    """
+    source = tempfile.mkdtemp(prefix="izv-check-server-")
+    folder = tempfile.mkdtemp(prefix="izv-check-")
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _ArchiveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        paths = make_synthetic_data(source, rows, archives=3, seed=seed)
+        server.files = {}
+        for path in paths:
+            with open(source + os.path.sep + path[5:], 'rb') as f:
+                server.files[path[5:]] = f.read()
+        server.failing = set()
+        server.requests = []
+
+        url = f'http://127.0.0.1:{server.server_address[1]}/'
+        first = folder + os.path.sep + paths[0][5:]
+
+        def run(name: str, expected: dict, error: bool = False):
+            downloader = DataDownloader(url=url, folder=folder, lazy=True, metrics=Metrics())
+            server.requests.clear()
+            try:
+                downloader.download_data(paths)
+            except Exception:
+                if not error:
+                    raise
+            else:
+                if error:
+                    raise AssertionError(f'{name}: failing download didn\'t raise error')
+
+            counters = downloader.metrics.snapshot()["counters"]
+            for counter, value in expected.items():
+                if counters.get(counter, 0) != value:
+                    raise AssertionError(f'{name}: {counter} is {counters.get(counter, 0)}, expected {value}')
+            for path in paths:
+                if path[5:] in server.failing:
+                    continue
+                with open(folder + os.path.sep + path[5:], 'rb') as f:
+                    if f.read() != server.files[path[5:]]:
+                        raise AssertionError(f'{name}: {path[5:]} differs from served file')
+                if os.path.exists(folder + os.path.sep + path[5:] + '.part'):
+                    raise AssertionError(f'{name}: {path[5:]}.part was left in folder')
+            print(f'{name:<24} requests={len(server.requests)}  ok')
+
+        size = len(server.files[paths[0][5:]])
+        run("download", {"files_downloaded": 3, "bytes_downloaded": sum(map(len, server.files.values()))})
+        run("not modified", {"files_not_modified": 3})
+
+        def interrupt(part: bytes):
+            with open(folder + os.path.sep + 'index.json', 'r') as f:
+                validators = json.load(f)["archives"][paths[0][5:]]
+            os.replace(first, first + '.part')
+            with open(first + '.part', 'r+b') as f:
+                f.truncate(len(part))
+                f.seek(0)
+                f.write(part)
+            with open(first + '.part.json', 'w') as f:
+                json.dump(validators, f)
+
+        interrupt(server.files[paths[0][5:]][:size // 3])
+        run("resume", {"files_downloaded": 1, "bytes_downloaded": size - size // 3, "files_not_modified": 2})
+        interrupt(server.files[paths[0][5:]])
+        run("complete part", {"files_downloaded": 1, "bytes_downloaded": 0, "files_not_modified": 2})
+        interrupt(server.files[paths[0][5:]] + b'\0' * 16)
+        run("overlong part", {"files_downloaded": 1, "bytes_downloaded": size, "files_not_modified": 2})
+
+        # Files changed on server, one of them can't be downloaded
+        for name in server.files:
+            server.files[name] += b'\0'
+        server.failing = {paths[1][5:]}
+        run("failing download", {"files_downloaded": 2}, error=True)
+        with open(folder + os.path.sep + 'index.json', 'r') as f:
+            archives = json.load(f)["archives"]
+        for path in [paths[0], paths[2]]:
+            if archives[path[5:]]["etag"] != '"' + hashlib.sha1(server.files[path[5:]]).hexdigest() + '"':
+                raise AssertionError(f'failing download: headers of {path[5:]} weren\'t saved')
+        server.failing = set()
+        run("after failure", {"files_downloaded": 1, "files_not_modified": 2})
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(source, ignore_errors=True)
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+class _TileHandler(http.server.BaseHTTPRequestHandler):
+    """Handler of local http server standing in for tile server in check_tiles function, answers every
+    '/{z}/{x}/{y}.png' with server.tile (PNG data) and appends path to server.requests."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(self.server.tile)))
+        self.end_headers()
+        self.wfile.write(self.server.tile)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def check_tiles():
+    """Checks tiles.TileCache against local http server standing in for tile server, prints results to stdout. Checked
+    cases are:
+        importing geo module (with its default tile cache) doesn't create any folder,
+        basemap is drawn with attribution and downloaded tiles are saved to folder created on first tile,
+        other instance with the same folder draws basemap without any request,
+        offline instance doesn't request tiles missing in folder,
+        size of folder is kept under max_bytes by removing least recently used tiles.
+
+    If any case fails, AssertionError is raised.
+    """
+    import tiles
+    import matplotlib.image
+    import matplotlib.pyplot as plt
+
+    matplotlib.use("Agg")
+
+    folder = tempfile.mkdtemp(prefix="izv-check-")
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _TileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        tile = io.BytesIO()
+        matplotlib.image.imsave(tile, np.full((256, 256, 3), 0.5), format='png')
+        server.tile = tile.getvalue()
+        server.requests = []
+        url = f'http://127.0.0.1:{server.server_address[1]}/{{z}}/{{x}}/{{y}}.png'
+        tiles_folder = os.path.join(folder, "tiles")
+        # Brno at zoom 12
+        bounds = (1_830_000, 6_300_000, 1_850_000, 6_320_000)
+
+        # geo module needs geographic libraries, which aren't needed by other checks
+        code = 'import geo, os; print(os.listdir("."))'
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)), MPLBACKEND="Agg")
+        result = subprocess.run([sys.executable, "-c", code], cwd=folder, env=env, capture_output=True, text=True)
+        if result.returncode:
+            print('import of geo is skipped: ' + result.stderr.strip().splitlines()[-1], file=sys.stderr)
+        elif result.stdout.strip() != "[]":
+            raise AssertionError(f'import of geo created {result.stdout.strip()} in working folder')
+        else:
+            print(f'{"import geo":<24} no folder created  ok')
+
+        def draw(cache: tiles.TileCache):
+            server.requests.clear()
+            fig, ax = plt.subplots()
+            ax.set_xlim(bounds[0], bounds[2])
+            ax.set_ylim(bounds[1], bounds[3])
+            cache.add_basemap(ax, 12)
+            texts = [text.get_text() for text in ax.texts]
+            plt.close(fig)
+            if cache.attribution not in texts:
+                raise AssertionError('basemap is drawn without attribution')
+            return len(server.requests)
+
+        cache = tiles.TileCache(url=url, folder=tiles_folder)
+        if os.path.exists(tiles_folder):
+            raise AssertionError('TileCache constructor created folder')
+        x0, x1, y0, y1 = cache.tile_range(bounds, 12)
+        expected = (x1 - x0 + 1) * (y1 - y0 + 1)
+        if (requests := draw(cache)) != expected or cache.cache_size() != expected * len(server.tile):
+            raise AssertionError(f'first basemap made {requests} requests, expected {expected} saved tiles')
+        print(f'{"download":<24} requests={requests}  ok')
+
+        if (requests := draw(tiles.TileCache(url=url, folder=tiles_folder))) != 0:
+            raise AssertionError(f'cached basemap made {requests} requests')
+        print(f'{"cached":<24} requests={requests}  ok')
+
+        bounds = (1_930_000, 6_300_000, 1_950_000, 6_320_000)
+        if (requests := draw(tiles.TileCache(url=url, folder=tiles_folder, offline=True))) != 0:
+            raise AssertionError(f'offline basemap made {requests} requests')
+        print(f'{"offline":<24} requests={requests}  ok')
+
+        cache = tiles.TileCache(url=url, folder=tiles_folder, max_bytes=5 * len(server.tile))
+        requests = draw(cache)
+        if cache.cache_size() > cache.max_bytes:
+            raise AssertionError(f'size of folder {cache.cache_size()} exceeds {cache.max_bytes} bytes')
+        print(f'{"eviction":<24} requests={requests}  tiles={cache.cache_size() // len(server.tile)}  ok')
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def _measure(run, setup=None, repeats: int = 3):
+    """Measures time and peak of allocated memory of function.
+
+    Time is the best of repeats runs, peak of memory is measured by extra run with tracemalloc, so tracing doesn't
+    slow down timed runs.
+
+    Parameters:
+        run : callable
+            Measured function, takes values returned by setup as arguments.
+        setup : callable, optional, default: None
+            Function called before each run (not measured), returns tuple of arguments of run.
+        repeats : int
+            Number of timed runs.
+
+    Returns:
+        dict
+            Time in seconds as 'time' and peak of allocated memory in bytes as 'peak'.
+    """
+    times = []
+    for _ in range(repeats):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup() if setup else ()
+    tracemalloc.start()
+    run(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"time": min(times), "peak": peak}
+
+
+def bench_stages(scales: list = None, repeats: int = 3, folder: str = None, seed: int = 0):
+    """Measures time and peak of allocated memory of each stage of data processing on synthetic data (see
+    make_synthetic_data function) of growing number of rows, prints results to stdout. Runs fully offline.
+
+    Stages:
+        parse_region_data, parsing of one region (PHA) from archives,
+        parse_python, parsing of the same region by "python" reference parser engine,
+        get_dict_cold, parsing of all the regions and saving their caches (serially, so memory is traced),
+        get_dict_warm, loading of all the regions from disk cache by new instance,
+        get_dict_memory, second call of get_dict method on same instance (in memory cache),
+        duplicates_mask, finding duplicate accident IDs of all the rows,
+        load_dict_cache, loading of cache of each region,
+        get_dataframe, analysis.get_dataframe from pickled data frame,
+        load_dataframe, analysis.load_dataframe from cache,
+        plot_stat, get_stat.plot_stat to PNG file (Agg backend),
+        cube_update, building of cube.ReportCube from cache,
+        make_geo, geo.make_geo (skipped if geographic libraries aren't installed).
+
+    Parameters:
+        scales : list of int, optional, default: None
+            Numbers of rows of synthetic data. If None, 10000, 100000 and 1000000 rows are used.
+        repeats : int
+            Number of timed runs of each stage, the best time is kept.
+        folder : str, optional, default: None
+            Path to folder for synthetic data (subfolder for each scale), data already generated there are reused.
+            If None, temporary folder is used and removed afterwards.
+        seed : int
+            Seed of random generator of synthetic data.
+
+    Returns:
+        dict
+            Results with environment description, 'scales' holds 'number of rows : stage : dict of time and peak'.
+    """
+    import analysis
+    from cube import ReportCube
+
+    matplotlib.use("Agg")
+
+    try:
+        import geo
+    except ImportError as e:
+        print('make_geo stage is skipped: ' + format(e), file=sys.stderr)
+        geo = None
+
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "repeats": repeats,
+        "scales": {},
+    }
+
+    temporary = folder is None
+    if temporary:
+        folder = tempfile.mkdtemp(prefix="izv-bench-")
+
+    regions = list(DataDownloader.regions.keys())
+
+    try:
+        for rows in scales or [10_000, 100_000, 1_000_000]:
+            scale_folder = folder + os.path.sep + str(rows)
+            if not os.path.isfile(scale_folder + os.path.sep + 'index.json'):
+                make_synthetic_data(scale_folder, rows, seed=seed)
+
+            def downloader():
+                return DataDownloader(folder=scale_folder, lazy=True)
+
+            def remove_caches():
+                for region in regions:
+                    shutil.rmtree(scale_folder + os.path.sep + 'data_' + region, ignore_errors=True)
+                return downloader(),
+
+            def remove_cube():
+                shutil.rmtree(scale_folder + os.path.sep + 'cube', ignore_errors=True)
+                return ReportCube(downloader()),
+
+            # Each stage is (name, setup, run)
+            stages = [
+                ("parse_region_data", lambda: (downloader(),), lambda d: d.parse_region_data("PHA")),
+                ("parse_python", lambda: (downloader(),), lambda d: d.parse_region_data("PHA", "python")),
+                ("get_dict_cold", remove_caches, lambda d: d.get_dict()),
+                ("get_dict_warm", lambda: (downloader(),), lambda d: d.get_dict()),
+                ("get_dict_memory", lambda: (warm,), lambda d: d.get_dict()),
+                ("duplicates_mask", lambda: (ids,), DataDownloader.duplicates_mask),
+                ("load_dict_cache", lambda: (downloader(),), lambda d: [d.load_dict_cache(r) for r in regions]),
+                ("get_dataframe", None,
+                 lambda: analysis.get_dataframe(scale_folder + os.path.sep + 'accidents.pkl.gz')),
+                ("load_dataframe", lambda: (downloader(),), lambda d: analysis.load_dataframe(d)),
+                ("plot_stat", None, lambda: get_stat.plot_stat(stat_data, scale_folder + os.path.sep + 'stat.png')),
+                ("cube_update", remove_cube, lambda c: c.update()),
+            ]
+            if geo is not None:
+                stages.append(("make_geo", None, lambda: geo.make_geo(geo_df)))
+
+            # Inputs of stages, which don't read files
+            warm = downloader()
+            data = warm.get_dict()
+            ids = data["p1"]
+            stat_data = {key: data[key] for key in ["p24", "region"]}
+            geo_df = analysis.load_dataframe(warm, columns=["p36", "p2a", "d", "e", "region"])
+            pd.DataFrame({key: np.asarray(values).astype(str) if np.asarray(values).dtype.kind == "S"
+                          else np.asarray(values) for key, values in data.items()}).to_pickle(
+                scale_folder + os.path.sep + 'accidents.pkl.gz')
+            del data
+
+            results["scales"][str(rows)] = {}
+            for name, setup, run in stages:
+                result = _measure(run, setup, repeats)
+                results["scales"][str(rows)][name] = result
+                print(f'rows={rows:<9} stage={name:<18} time={result["time"]:8.3f} s  '
+                      f'peak={result["peak"] / 1_048_576:8.1f} MB')
+    finally:
+        if temporary:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return results
+
+
+def compare_results(old: dict, new: dict, tolerance: float = 0.1):
+    """Compares results of two runs of bench_stages function, prints ratio of new to old time and peak of memory of
+    each stage measured in both runs to stdout.
+
+    Parameters:
+        old : dict
+            Results of previous run.
+        new : dict
+            Results of current run.
+        tolerance : float
+            Allowed relative growth, e.g. 0.1 allows new value to be 10 % greater than old value.
+
+    Returns:
+        list of tuple of (str, str, str, float, float)
+            Regressions as (number of rows, stage, 'time' or 'peak', old value, new value).
+    """
+    regressions = []
+
+    for rows, stages in new["scales"].items():
+        for stage, result in stages.items():
+            old_result = old["scales"].get(rows, {}).get(stage)
+            if old_result is None:
+                continue
+
+            ratios = []
+            for metric in ["time", "peak"]:
+                ratio = result[metric] / old_result[metric] if old_result[metric] else 1.0
+                ratios.append(ratio)
+                if ratio > 1 + tolerance:
+                    regressions.append((rows, stage, metric, old_result[metric], result[metric]))
+
+            print(f'rows={rows:<9} stage={stage:<18} time={ratios[0]:6.2f}x  peak={ratios[1]:6.2f}x'
+                  + ('  REGRESSION' if max(ratios) > 1 + tolerance else ''))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--cluster-rows", type=int, nargs="+", default=[10_000, 50_000, 200_000])
+
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--suite", action="store_true")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--folder")
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    if args.check:
+        check_duplicates()
+        check_engines()
+        check_download()
+        check_tiles()
+        exit(0)
+
+    if not args.suite:
+        bench_workers(args.workers)
+        bench_merge_memory()
+        bench_schema_memory()
+        bench_crosstab(args.rows)
+        bench_cluster(args.cluster_rows)
+        exit(0)
+
+    results = bench_stages(args.scales, args.repeats, args.folder)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare_results(json.load(f), results, args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regressions against {args.compare}', file=sys.stderr)
+            exit(-1)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module containing one class ReportCube, materialized aggregate of data from Czech republic police department
+website, so reports can read accident counts without loading row level data.
+
+Cube holds count of accidents and sums of measures for each combination of dimensions:
+    region, month (of p2a), road class (p36), cause (p12), priority (p24), severity (p9, p13a).
+
+Can be imported as module, or run as main script.
+If run as main script, updates cube from cached data of all the regions and prints its size to stdout.
+Out of non-built-in libraries this module uses numpy and pandas (through download module)
+"""
+
+import os
+import re
+import sys
+import time
+import numpy as np
+import schema
+import download
+from download import DataDownloader
+
+
+class ReportCube:
+    """Class for building, updating and reading aggregated data
+
+    Cube is dictionary of numpy.ndarray (same as data of DataDownloader.get_dict), one row for each combination of
+    dimensions present in data, with columns:
+        dimensions, values of dimensions (month is p2a truncated to month),
+        count, number of accidents,
+        sum_<measure>, sum of measure column (invalid values are not counted).
+
+    Attributes
+        dimensions : list of str [Class Attribute]
+            Dimensions of cube.
+        measures : list of str [Class Attribute]
+            Summed columns.
+        downloader : DataDownloader [Instance Attribute]
+            Instance providing data of regions, None if cube is only read.
+        folder : str [Instance Attribute]
+            Path to folder with data.
+        cube_filename : str [Instance Attribute]
+            Name of folder in folder, which holds cube.
+        __cube : dict of numpy.ndarray [Instance Attribute]
+            Loaded cube, None if not loaded yet.
+    """
+
+    dimensions = ["region", "month", "p36", "p12", "p24", "p9", "p13a"]
+
+    measures = ["p13a", "p13b", "p13c", "p14", "p53"]
+
+    def __init__(self, downloader: DataDownloader = None, folder: str = None, cube_filename: str = "cube"):
+        """
+        Parameters:
+            downloader : DataDownloader, optional, default: None
+                Instance providing data of regions. If None, cube can be only read.
+            folder : str, optional, default: None
+                Path to folder with data. If None, folder of downloader is used ('data' without downloader).
+            cube_filename : str
+                Name of folder in folder, which holds cube.
+        """
+        self.downloader = downloader
+        self.folder = folder or (downloader.folder if downloader else "data")
+        self.cube_filename = cube_filename
+        self.__cube = None
+
+    @staticmethod
+    def aggregate(keys: dict, values: dict):
+        """Groups rows by all the keys and sums values of each group.
+
+        Parameters:
+            keys : dict of numpy.ndarray
+                Columns, by which rows are grouped.
+            values : dict of numpy.ndarray
+                Summed columns.
+
+        Returns:
+            dict of numpy.ndarray
+                Keys of groups (sorted) and sums of values (int64) as 'column name : numpy.ndarray'.
+        """
+        # Each key column is replaced with index of its unique value, indexes are combined to one integer key
+        combined = np.zeros(next(iter(values.values())).size, np.int64)
+        labels, sizes = [], []
+        for column in keys.values():
+            label, code = np.unique(column, return_inverse=True)
+            labels.append(label)
+            sizes.append(max(label.size, 1))
+            combined = combined * sizes[-1] + code.ravel()
+
+        groups, inverse = np.unique(combined, return_inverse=True)
+
+        result = {key: label[index] for key, label, index in zip(keys, labels, np.unravel_index(groups, sizes or [1]))}
+        for key, column in values.items():
+            result[key] = np.bincount(inverse, column, groups.size).astype(np.int64)
+
+        return result
+
+    def aggregate_rows(self, data: dict):
+        """Aggregates row level data to cube.
+
+        Parameters:
+            data : dict of numpy.ndarray
+                Data with columns p2a, dimensions and measures, e.g. from DataDownloader.get_dict method.
+
+        Returns:
+            dict of numpy.ndarray
+                Cube of data.
+        """
+        keys = {key: data["p2a"].astype("datetime64[M]") if key == "month" else data[key] for key in self.dimensions}
+
+        values = {"count": np.ones(data["p2a"].size, np.int64)}
+        for key in self.measures:
+            values["sum_" + key] = np.where(data[key] == schema.COLUMNS_BY_NAME[key].null, 0, data[key])
+
+        return self.aggregate(keys, values)
+
+    def update(self, workers: int = None):
+        """Updates cube with data of all the regions, new or changed files are parsed by downloader first.
+
+        Rows of each region cache are stored in order of files, from which they were parsed, so only rows of files not
+        counted yet are aggregated and added to cube. If some counted file was changed or removed, cube is built again.
+        Duplicate rows (by accident ID, p1) are counted once, same as in DataDownloader.get_dict method. Rows of new
+        files with ID, which is already counted, are not counted again.
+
+        If there is no downloader, method halts the script run.
+
+        Parameters:
+            workers : int, optional, default: None
+                Number of processes used for parsing regions, see DataDownloader.get_dict method.
+
+        Returns:
+            dict of numpy.ndarray
+                Updated cube.
+        """
+        if self.downloader is None:
+            print('Cube can\'t be updated without downloader', file=sys.stderr)
+            exit(-1)
+
+        # Regions caches are updated with new or changed files
+        self.downloader.get_dict(workers=workers, columns=[schema.HEADERS[0]])
+
+        manifest = self.load_manifest()
+        cube = self.load() if manifest else None
+
+        regions_sources = {}
+        for region in self.downloader.regions:
+            region_manifest = self.downloader.load_cache_manifest(region)
+            regions_sources[region] = [{key: source.get(key) for key in ["name", "sha1", "rows"]}
+                                       for source in region_manifest.get("sources",
+                                                                         [{"rows": region_manifest["rows"]}])]
+
+        # Cube is built again, if counted files of any region aren't first files of its cache
+        if not cube or any(manifest["regions"].get(region, []) != sources[:len(manifest["regions"].get(region, []))]
+                           for region, sources in regions_sources.items()):
+            manifest = {"regions": {}}
+            cube = None
+            ids = np.array([], schema.COLUMNS_BY_NAME[schema.HEADERS[0]].dtype)
+        else:
+            ids = np.load(self.folder + os.path.sep + self.cube_filename + os.path.sep + 'ids.npy', allow_pickle=False)
+
+        columns = [schema.HEADERS[0], "p2a", *self.dimensions[2:], *self.measures, "region"]
+        parts = [] if cube is None else [cube]
+
+        for region, sources in regions_sources.items():
+            counted = manifest["regions"].get(region, [])
+            if len(counted) == len(sources):
+                continue
+
+            start = sum(source["rows"] for source in counted)
+            region_data = self.downloader.load_dict_cache(region, columns)
+            region_data = {key: values[start:] for key, values in region_data.items()}
+
+            # Rows with ID counted before (in previous regions or files) are skipped
+            mask = ~self.downloader.duplicates_mask(region_data[schema.HEADERS[0]])
+            mask &= ~np.isin(region_data[schema.HEADERS[0]], ids, assume_unique=False)
+            ids = np.union1d(ids, region_data[schema.HEADERS[0]][mask])
+
+            parts.append(self.aggregate_rows({key: values[mask] for key, values in region_data.items()}))
+            manifest["regions"][region] = sources
+
+        # Parts have same columns, joined parts are aggregated again to merge groups present in more parts
+        if not parts:
+            cube = self.aggregate_rows(self.downloader.init_region_data_dict())
+        elif cube is None or len(parts) > 1:
+            joined = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+            cube = self.aggregate({key: joined[key] for key in self.dimensions},
+                                  {key: joined[key] for key in joined if key not in self.dimensions})
+
+        self.save(cube, manifest, ids)
+
+        return cube
+
+    def get(self, dimensions: list = None, where: dict = None):
+        """Gets cube rolled up to provided dimensions, read from memory or from disk. Cube isn't updated, see update
+        method. If cube wasn't built yet, it's built by update method.
+
+        If cube can't be built (there is no downloader), method halts the script run.
+
+        Parameters:
+            dimensions : list of str, optional, default: None
+                Dimensions kept in result, other dimensions are summed up. If None, all the dimensions are kept.
+
+                If any of strings isn't dimension of cube, method halts the script run.
+            where : dict, optional, default: None
+                Condition for rows of cube, applied before rolling up, see DataDownloader.where_mask method.
+                Columns used in condition don't have to be in dimensions.
+
+        Returns:
+            dict of numpy.ndarray
+                Rolled up cube.
+        """
+        if dimensions is None:
+            dimensions = self.dimensions
+
+        for column in [*dimensions, *(where or {})]:
+            if column not in self.dimensions:
+                print('Invalid dimension name', file=sys.stderr)
+                exit(-1)
+
+        if self.__cube is None and not self.load():
+            self.update()
+
+        cube = self.__cube
+        if where:
+            mask = DataDownloader.where_mask(cube, where)
+            cube = {key: values[mask] for key, values in cube.items()}
+
+        if dimensions == self.dimensions:
+            return cube
+
+        return self.aggregate({key: cube[key] for key in dimensions},
+                              {key: values for key, values in cube.items() if key not in self.dimensions})
+
+    def load_manifest(self):
+        """Loads manifest of cube, see save method.
+
+        Returns:
+            dict
+                Manifest, None if cube wasn't saved yet.
+        """
+        return download.load_manifest(self.folder + os.path.sep + self.cube_filename)
+
+    def load(self):
+        """Loads cube from disk.
+
+        Returns:
+            dict of numpy.ndarray
+                Loaded cube, False if cube wasn't saved yet.
+        """
+        if (manifest := self.load_manifest()) is None:
+            return False
+
+        self.__cube = {key: np.load(self.folder + os.path.sep + self.cube_filename + os.path.sep + filename,
+                                    allow_pickle=False) for key, filename in manifest["columns"].items()}
+
+        return self.__cube
+
+    def save(self, cube: dict, manifest: dict, ids: np.ndarray):
+        """Saves cube to folder named as cube_filename. Each column is saved as separate numpy file (.npy), IDs of
+        counted rows to 'ids.npy'. File 'manifest.json' holds file names of columns and counted files of each region.
+
+        Files are saved by download.save_columns function, so the cube interrupted during saving is never loaded.
+
+        Parameters:
+            cube : dict of numpy.ndarray
+                Saved cube.
+            manifest : dict
+                Manifest with counted files of each region as 'regions'.
+            ids : numpy.ndarray
+                Sorted IDs (p1) of counted rows.
+        """
+        manifest = {**manifest, "columns": {key: re.sub(r'\W', '_', key) + '.npy' for key in cube}}
+        files = {manifest["columns"][key]: values for key, values in cube.items()}
+        files['ids.npy'] = ids
+
+        download.save_columns(self.folder + os.path.sep + self.cube_filename, files, manifest)
+
+        self.__cube = cube
+
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    cube = ReportCube(DataDownloader()).update()
+    print(f'cube updated in {time.perf_counter() - start:.2f} s, {cube["count"].size} groups, '
+          f'{cube["count"].sum()} accidents')
+
+    start = time.perf_counter()
+    ReportCube().get(["region", "p24"])
+    print(f'cube read in {(time.perf_counter() - start) * 1000:.1f} ms')
@@ -2,109 +2,162 @@
 # coding=utf-8
 
 import seaborn as sns
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import schema
+from report import save_figure
+
+
+# Labels of cause families (p12 // 100 * 100)
+CAUSES = {
+    100: "nezaviněná řidičem",
+    200: "nepřiměřená rychlost jízdy",
+    300: "nesprávné předjíždění",
+    400: "nedání přednosti v jízdě",
+    500: "nesprávný způsob jízdy",
+    600: "technická závada vozidla"
+}
+
+# Labels of causes of 5xx family (unappropriated driving style)
+DRIVING = {
+    501: "jízda po nesprávné straně vozovky, vjetí do protisměru",
+    502: "vyhýbání bez dostatečného bočního odstupu (vůle)",
+    503: "nedodržení bezpečné vzdálenosti za vozidlem",
+    504: "nesprávné otáčení nebo couvání",
+    505: "chyby při udání směru jízdy",
+    506: "bezohledná, agresivní, neohleduplná jízda",
+    507: "náhlé bezdůvodné snížení rychlosti jízdy, zabrzdění nebo zastavení",
+    508: "řidič se plně nevěnoval řízení vozidla",
+    509: "samovolné rozjetí nezajištěného vozidla",
+    510: "vjetí na nezpevněnou komunikaci",
+    511: "nezvládnutí řízení vozidla",
+    512: "jízda (vjetí) jednosměrnou ulicí, silnicí (v protisměru)",
+    513: "nehoda v důsledku  použití (policií) prostředků k násilnému zastavení vozidla (zastavovací pásy, "
+         + "zábrana, vozidlo atp.)",
+    514: "nehoda v důsledku použití služební zbraně (policií)",
+    515: "nehoda při provádění služebního zákroku (pronásledování pachatele atd.)",
+    516: "jiný druh nesprávného způsobu jízdy"
+}
+
+
+def make_tables(df: pd.DataFrame, by: str = None) -> dict:
+    """
+    Computes values of document in single pass over data frame, for whole data frame or for each group of rows.
+
+    Accidents that took life are selected by one mask, causes (p12) are rolled up to families by integer division and
+    all the counts are made by numpy.bincount over combined key of group and cause.
+
+    Parameters:
+        df : pd.DataFrame
+            Data with columns p9, p12, p13a (and by).
+        by : str
+            Column, by which rows are grouped, e.g. "region". If None, whole data frame is one group.
+
+    Returns:
+        dict of (object, dict)
+            Group value (None if by is None) : tables of group as dictionary:
+                accidents, count of accidents,
+                fatal, count of accidents that took one or more life,
+                deaths, number of deaths in first 24h after accident,
+                causes, pd.DataFrame with columns p12 (family label) and cnt, sorted by cnt ascending,
+                driving, pd.DataFrame with columns p12 (5xx cause label), cnt and pct, sorted by cnt descending.
+    """
+
+    if by is None:
+        codes, groups = np.zeros(len(df.index), np.intp), [None]
+    else:
+        codes, groups = pd.factorize(df[by], sort=True)
+
+    # Missing values (pandas.NA) are counted as no deaths, no severity and no cause
+    p13a = df["p13a"].to_numpy(np.float64, na_value=0)
+    fatal = df["p9"].to_numpy(np.float64, na_value=0) == 1
+    codes_fatal = codes[fatal]
+    p12 = df["p12"].to_numpy(np.float64, na_value=0)[fatal].astype(np.intp)
+    family = p12 // 100
+    # Null value (65535) and codes out of cause families are not counted in any family
+    valid = (family >= 1) & (family <= 6)
+
+    accidents = np.bincount(codes, minlength=len(groups))
+    fatal_counts = np.bincount(codes_fatal, minlength=len(groups))
+    deaths = np.bincount(codes, np.where(p13a == schema.COLUMNS_BY_NAME["p13a"].null, 0, p13a), len(groups))
+
+    # Counts of (group, family) and (group, 5xx cause) pairs
+    families = np.bincount(codes_fatal[valid] * 7 + family[valid], minlength=len(groups) * 7)
+    families = families.reshape(len(groups), 7)[:, 1:]
+    driving_mask = (p12 >= 501) & (p12 <= 516)
+    driving = np.bincount(codes_fatal[driving_mask] * 16 + p12[driving_mask] - 501, minlength=len(groups) * 16)
+    driving = driving.reshape(len(groups), 16)
+
+    tables = {}
+    for i, group in enumerate(groups):
+        causes = pd.DataFrame({"p12": [CAUSES[family] for family in CAUSES], "cnt": families[i]})
+        causes = causes[causes["cnt"] > 0].sort_values(by=["cnt"], kind="stable").reset_index(drop=True)
+
+        driving_table = pd.DataFrame({"p12": list(DRIVING.values()), "cnt": driving[i]})
+        driving_table = driving_table[driving_table["cnt"] > 0].sort_values(by=["cnt"], ascending=False,
+                                                                            kind="stable").reset_index(drop=True)
+        driving_table["pct"] = (driving_table["cnt"] / driving_table["cnt"].sum() * 100).round(1)
+
+        tables[group] = {
+            "accidents": int(accidents[i]),
+            "fatal": int(fatal_counts[i]),
+            "deaths": int(deaths[i]),
+            "causes": causes,
+            "driving": driving_table,
+        }
+
+    return tables
+
+
+def make_doc(df: pd.DataFrame, fig_location: str = "fig.pdf", tables: dict = None):
+    """
+    Prints values of document and saves graph of fatal accidents by cause family.
+
+    Parameters:
+        df : pd.DataFrame
+            Data with columns p9, p12, p13a. Not used if tables are provided.
+        fig_location : str
+            Path to save the figure, if None, figure is not saved.
+        tables : dict
+            Tables of one group made by make_tables function. If None, tables are made from df.
+    """
+
+    if tables is None:
+        tables = make_tables(df)[None]
 
-
-def make_doc(df: pd.DataFrame):
     # Print data
     print("----------------------------------------")
     print("[DATA]")
-    print("accidents that took one or more life: " + str(len(df[df['p9'] == 1].index)))
-    print("That is % of all accidents: " + str(round(len(df[df['p9'] == 1].index) / len(df.index) * 100, 2)) + "%")
-    print("Number of deaths in first 24h after accident: " + str(df['p13a'].sum()))
-
-    # Keep only accidents that took life
-    df1 = df[df["p9"] == 1]
-
-    # Keep only p12 (accident cause) column
-    df1 = df1[['p12']]
-
-    # Group accidents cause to main reason categories
-    df1[(df1["p12"] >= 201) & (df1["p12"] <= 209)] = 200
-    df1[(df1["p12"] >= 301) & (df1["p12"] <= 311)] = 300
-    df1[(df1["p12"] >= 401) & (df1["p12"] <= 414)] = 400
-    df1[(df1["p12"] >= 501) & (df1["p12"] <= 516)] = 500
-    df1[(df1["p12"] >= 601) & (df1["p12"] <= 615)] = 600
-
-    # Count by accidents cause (p12)
-    df1['cnt'] = 0
-    df1 = df1.groupby(['p12']).agg({'cnt': 'count'})
-    df1.sort_values(by=['cnt'], inplace=True)
-    df1.reset_index(level=0, inplace=True)
-
-    # Set ticks labels
-    df1['p12'] = df1['p12'].replace({
-         100: "nezaviněná řidičem",
-         200: "nepřiměřená rychlost jízdy",
-         300: "nesprávné předjíždění",
-         400: "nedání přednosti v jízdě",
-         500: "nesprávný způsob jízdy",
-         600: "technická závada vozidla"
-    })
+    print("accidents that took one or more life: " + str(tables["fatal"]))
+    print("That is % of all accidents: " + (str(round(tables["fatal"] / tables["accidents"] * 100, 2)) + "%"
+                                            if tables["accidents"] else "n/a"))
+    print("Number of deaths in first 24h after accident: " + str(tables["deaths"]))
 
     # Print plot data
     print("----------------------------------------")
     print("\tGraph values:")
-    print(df1.to_string(index=False))
+    print(tables["causes"].to_string(index=False))
 
     # Style and save plot
     fig, ax = plt.subplots(figsize=(7, 2))
-    sns.barplot(ax=ax, data=df1, x='cnt', y='p12', palette='Blues_d', orient='h')
+    sns.barplot(ax=ax, data=tables["causes"], x='cnt', y='p12', palette='Blues_d', orient='h')
     ax.set_title('Celkové počty smrteľných nehôd, podľa ich hlavnej príčiny', fontweight='bold')
     ax.set(ylabel='', xlabel='')
     ax.set(xlim=(0, 50000))
     ax.tick_params(axis='both', width=0)
     plt.yticks(fontsize=8)
     plt.tight_layout()
-    plt.savefig('fig.pdf')
-    plt.close(fig)
-
-    # Keep only accidents that took life
-    df1 = df[df["p9"] == 1]
-
-    # Keep only p12 (accident cause) column
-    df1 = df1[['p12']]
-
-    # Keep only 5xx accident causes (unappropriated driving style)
-    df1 = df1[(df1["p12"] >= 501) & (df1["p12"] <= 516)]
-
-    # Count by accidents cause (p12)
-    df1['cnt'] = 0
-    df1['pct'] = 0
-    df1 = df1.groupby(['p12']).agg({'cnt': 'count'})
-    df1.sort_values(by=['cnt'], inplace=True, ascending=False)
-    df1.reset_index(level=0, inplace=True)
-    sum = df1['cnt'].sum()
-    df1['pct'] = round(df1['cnt'] / sum * 100, 1)
-
-    # Replace count labels and rename columns
-    df1['p12'] = df1['p12'].replace({
-        501: "jízda po nesprávné straně vozovky, vjetí do protisměru",
-        502: "vyhýbání bez dostatečného bočního odstupu (vůle)",
-        503: "nedodržení bezpečné vzdálenosti za vozidlem",
-        504: "nesprávné otáčení nebo couvání",
-        505: "chyby při udání směru jízdy",
-        506: "bezohledná, agresivní, neohleduplná jízda",
-        507: "náhlé bezdůvodné snížení rychlosti jízdy, zabrzdění nebo zastavení",
-        508: "řidič se plně nevěnoval řízení vozidla",
-        509: "samovolné rozjetí nezajištěného vozidla",
-        510: "vjetí na nezpevněnou komunikaci",
-        511: "nezvládnutí řízení vozidla",
-        512: "jízda (vjetí) jednosměrnou ulicí, silnicí (v protisměru)",
-        513: "nehoda v důsledku  použití (policií) prostředků k násilnému zastavení vozidla (zastavovací pásy, "
-             + "zábrana, vozidlo atp.)",
-        514: "nehoda v důsledku použití služební zbraně (policií)",
-        515: "nehoda při provádění služebního zákroku (pronásledování pachatele atd.)",
-        516: "jiný druh nesprávného způsobu jízdy"
-    })
-    df1.rename(columns={"p12": "Nesprávny způsob jízdy (detailný důvod)", "cnt": "počet smrtí", "pct": "%"},
-               inplace=True)
+    save_figure(fig, fig_location)
+
+    # Rename columns
+    driving = tables["driving"].rename(columns={"p12": "Nesprávny způsob jízdy (detailný důvod)", "cnt": "počet smrtí",
+                                                "pct": "%"})
 
     # Print table
     print("----------------------------------------")
     print("\tTable values:")
-    print(df1.to_string(index=False))
+    print(driving.to_string(index=False))
 
 
 if __name__ == "__main__":
@@ -6,25 +6,118 @@ website.
 
 Can be imported as module, or run as main script.
 If run as main script, downloads and parses data from 'JHC', 'PLK' and 'ULK' regions and prints basic information about
-data to stdout.
-Out of non-built-in libraries this script uses numpy, BeautifulSoup and requests
+data and report of run (see metrics module) to stdout.
+Out of non-built-in libraries this script uses numpy, pandas, BeautifulSoup and requests
 """
 
 # Resources
 # https://stackoverflow.com/questions/7332841/add-single-element-to-array-in-numpy (answer from Jurgen Strydom)
 
+import concurrent.futures
 import csv
 import datetime
+import functools
 import io
+import json
 import os
 import re
 import sys
 import requests
+import requests.adapters
 import zipfile
 import gzip
+import hashlib
 import numpy as np
+import pandas as pd
 import pickle as pkl
 from bs4 import BeautifulSoup
+import schema
+from metrics import Metrics
+
+
+def _stage(name: str):
+    """Decorator measuring each call of DataDownloader method as stage of its metrics, see metrics module.
+
+    Parameters:
+        name : str
+            Stage name.
+
+    Returns:
+        callable
+            Decorator.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def save_columns(folder: str, files: dict, manifest: dict):
+    """Saves column store, numpy files (.npy) and 'manifest.json' describing them, to folder, used for region caches
+    (DataDownloader.save_dict_cache) and cube (cube.ReportCube.save).
+
+    Manifest is removed first and written as last, so the store without manifest (interrupted saving) is never loaded.
+    Files are written to temporary files and renamed, not overwritten, so already memory mapped data stay valid.
+
+    Parameters:
+        folder : str
+            Path to folder, created if doesn't exist.
+        files : dict of (str, numpy.ndarray)
+            File name : saved array.
+        manifest : dict
+            Saved manifest.
+    """
+    manifest_path = folder + os.path.sep + 'manifest.json'
+
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+    elif not os.path.isdir(folder):
+        os.mkdir(folder)
+
+    for filename, values in files.items():
+        with open(folder + os.path.sep + filename + '.tmp', 'wb') as f:
+            np.save(f, values, allow_pickle=False)
+        os.replace(folder + os.path.sep + filename + '.tmp', folder + os.path.sep + filename)
+
+    save_manifest(folder, manifest)
+
+
+def save_manifest(folder: str, manifest: dict):
+    """Saves manifest of column store, see save_columns function. Manifest is written to temporary file first and
+    renamed, so it's never read half written.
+
+    Parameters:
+        folder : str
+            Path to folder of column store.
+        manifest : dict
+            Saved manifest.
+    """
+    manifest_path = folder + os.path.sep + 'manifest.json'
+
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def load_manifest(folder: str):
+    """Loads manifest of column store, see save_columns function.
+
+    Parameters:
+        folder : str
+            Path to folder of column store.
+
+    Returns:
+        dict
+            Manifest, None if there is no column store in folder.
+    """
+    try:
+        with open(folder + os.path.sep + 'manifest.json', 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
 
 
 class DataDownloader:
@@ -32,25 +125,39 @@ class DataDownloader:
 
     Attributes
         headers : list of str [Class Attribute]
-            CSV headers names.
+            CSV headers names, from schema module.
         regions : dict of (str, str) [Class Attribute]
             Region name : CSV number.
+        engines : tuple of str [Class Attribute]
+            Names of available parser engines, first one is the default.
         url : str [Instance Attribute]
             Address for data download.
         folder : str [Instance Attribute]
             Path to folder, which script will be using for needed temporary data, created if doesn't exists.
         cache_filename : str [Instance Attribute]
-            Specifies the name, for temporary data of individual regions.
+            Specifies the name of folder, for temporary data of individual regions.
+            Name have to contain '{}' as substring, which will be replaced with region tag.
+        legacy_cache_filename : str [Instance Attribute]
+            Specifies the name of pickle gzip file, for temporary data of individual regions made by older versions of
+            this script.
             Name have to contain '{}' as substring, which will be replaced with region tag.
+        index_filename : str [Instance Attribute]
+            Specifies the name of JSON file in folder, holding resolved paths and headers of downloaded files.
+        download_workers : int [Instance Attribute]
+            Number of threads used for downloading files.
+        revalidate : bool [Instance Attribute]
+            If true, already downloaded files are checked on server and downloaded again if they have changed.
+        lazy : bool [Instance Attribute]
+            If true, paths are resolved only when parsing needs them, stored paths are preferred.
+        metrics : Metrics [Instance Attribute]
+            Collects timings of stages, downloaded bytes, parsed rows and cache hits and misses.
+        paths : list of str [Instance Attribute]
+            Paths to files on police department server.
         __cache : dict of (str, dict) [Instance Attribute]
             Holds cache data as 'region tag : region data'.
     """
 
-    headers = ["p1", "p36", "p37", "p2a", "weekday(p2a)", "p2b", "p6", "p7", "p8", "p9", "p10", "p11", "p12", "p13a",
-               "p13b", "p13c", "p14", "p15", "p16", "p17", "p18", "p19", "p20", "p21", "p22", "p23", "p24", "p27",
-               "p28", "p34", "p35", "p39", "p44", "p45a", "p47", "p48a", "p49", "p50a", "p50b", "p51", "p52", "p53",
-               "p55a", "p57", "p58", "a", "b", "d", "e", "f", "g", "h", "i", "j", "k", "l", "n", "o", "p", "q", "r",
-               "s", "t", "p5a"]
+    headers = schema.HEADERS
 
     regions = {
         "PHA": "00",
@@ -69,10 +176,18 @@ class DataDownloader:
         "KVK": "19",
     }
 
+    engines = ("numpy", "python")
+
     def __init__(self,
                  url: str = "https://ehw.fit.vutbr.cz/izv/",
                  folder: str = "data",
-                 cache_filename: str = "data_{}.pkl.gz"):
+                 cache_filename: str = "data_{}",
+                 legacy_cache_filename: str = "data_{}.pkl.gz",
+                 index_filename: str = "index.json",
+                 download_workers: int = 4,
+                 revalidate: bool = False,
+                 lazy: bool = False,
+                 metrics: Metrics = None):
         """
         Parameters:
             url : str
@@ -80,41 +195,127 @@ class DataDownloader:
             folder : str
                 Path to folder, which script will be using for needed temporary data, created if doesn't exists.
             cache_filename : str
-                Specifies the name, for temporary data of individual regions.
+                Specifies the name of folder, for temporary data of individual regions.
+                Name have to contain '{}' as substring, which will be replaced with region tag.
+            legacy_cache_filename : str
+                Specifies the name of pickle gzip file, for temporary data of individual regions made by older versions
+                of this script. Such files are converted to new cache format when loaded.
                 Name have to contain '{}' as substring, which will be replaced with region tag.
+            index_filename : str
+                Specifies the name of JSON file in folder, holding ETag and Last-Modified headers of downloaded files.
+            download_workers : int
+                Number of threads (and pooled connections) used for downloading files.
+            revalidate : bool
+                If true, already downloaded files are checked on server with conditional requests and downloaded again
+                only if they have changed. Otherwise only missing files are downloaded.
+            lazy : bool
+                If true, paths to files on server are resolved (and missing files downloaded) only when parsing needs
+                them, paths stored in index_filename by previous runs are used without connecting to server.
+                Otherwise paths are resolved from server right away, stored paths are used only if server is not
+                reachable.
+            metrics : Metrics, optional, default: None
+                Instance collecting timings of stages and counters of run, see metrics module. Callbacks of metrics
+                get progress of run, e.g. start of each download. If None, metrics are collected without callbacks.
         """
 
         self.url = url
         self.folder = folder
         self.cache_filename = cache_filename
+        self.legacy_cache_filename = legacy_cache_filename
+        self.index_filename = index_filename
+        self.download_workers = download_workers
+        self.revalidate = revalidate
+        self.lazy = lazy
+        self.metrics = metrics or Metrics()
         self.__cache = {region: None for region in list(self.regions.keys())}
+        self.__paths = None
 
-        # http paths resolve from html
-        self.paths = []
-        resp = requests.get(self.url)
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        for tr_tag in soup.find_all('tr'):
-            self.paths.append(tr_tag.findChildren('button', class_='btn btn-sm btn-primary')[-1]['onclick'][10:-2])
+        self.__session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=download_workers)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
 
-        # download missing files
-        if os.path.isdir(folder):
-            paths = []
-
-            for path in self.paths:
-                if not os.path.isfile(folder + os.path.sep + path[5:]):
-                    paths.append(path)
-
-            self.download_data(paths)
-        else:
+        if not os.path.isdir(folder):
             if os.path.isfile(folder):
                 os.remove(folder)
 
             os.mkdir(folder)
-            self.download_data(self.paths)
+
+        if not lazy:
+            self.resolve_paths()
+
+    @property
+    def paths(self):
+        """list of str: Paths to files on police department server, resolved by resolve_paths method when first
+        needed."""
+        if self.__paths is None:
+            self.resolve_paths()
+        return self.__paths
+
+    @paths.setter
+    def paths(self, paths: list):
+        self.__paths = paths
+
+    @_stage("resolve_paths")
+    def resolve_paths(self):
+        """Resolves paths to files on police department server and downloads missing files.
+
+        In lazy mode, paths stored in index_filename are used if there are any, otherwise paths are resolved from
+        server html page. If server is not reachable, stored paths are used. Resolved paths are stored in
+        index_filename.
+
+        If paths can't be resolved from server nor from index_filename, method halts the script run.
+        """
+        index = self.load_index()
+
+        if self.lazy and index.get("paths") is not None:
+            self.__paths = index["paths"]
+        else:
+            # http paths resolve from html
+            try:
+                resp = self.__session.get(self.url, timeout=60)
+                resp.raise_for_status()
+            except requests.RequestException as e:
+                if index.get("paths") is None:
+                    print('Can\'t resolve data paths: ' + format(e), file=sys.stderr)
+                    exit(-1)
+                self.__paths = index["paths"]
+            else:
+                self.__paths = []
+                soup = BeautifulSoup(resp.text, 'html.parser')
+                for tr_tag in soup.find_all('tr'):
+                    self.__paths.append(
+                        tr_tag.findChildren('button', class_='btn btn-sm btn-primary')[-1]['onclick'][10:-2])
+
+                index["paths"] = self.__paths
+                self.save_index(index)
+
+        # download missing files
+        paths = []
+        for path in self.__paths:
+            if self.revalidate or not os.path.isfile(self.folder + os.path.sep + path[5:]):
+                paths.append(path)
+
+        if paths:
+            self.download_data(paths)
+
+    def __getstate__(self):
+        """Excludes in memory cache and http session from pickled state, so instance can be cheaply passed to worker
+        processes."""
+        state = self.__dict__.copy()
+        state['_DataDownloader__cache'] = {region: None for region in list(self.regions.keys())}
+        state['_DataDownloader__session'] = None
+        return state
 
     def download_data(self, paths: list):
         """Downloads data from provided paths.
 
+        Files are downloaded in parallel by download_workers threads sharing pooled http session. Each file is written
+        to temporary '.part' file first and renamed after it's complete, interrupted download is resumed with http
+        Range request next time. Already downloaded files are requested conditionally with their ETag and
+        Last-Modified headers (stored in index_filename), so unchanged files are not downloaded again. If any download
+        fails, headers of completed files are saved anyway and the first error is raised afterwards.
+
         This method should be prepended with '__' and made private, but it's not because of school assignment
         reasons.
 
@@ -122,20 +323,343 @@ class DataDownloader:
             paths : list of str
                 Strings representing paths to files on police department server.
         """
-        for path in paths:
-            print('Downloading "' + self.url + path + '"')
-            with requests.get(self.url + path, stream=True) as resp:
-                with open(self.folder + os.path.sep + path[5:], 'wb') as file:
-                    for chunk in resp.iter_content(chunk_size=128):
+        index = self.load_index()
+        error = None
+
+        with self.metrics.stage("download_data", files=len(paths)), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+            futures = [executor.submit(self.__download_file, path, index["archives"].get(path[5:])) for path in paths]
+
+            # Validators of completed files are saved even if other download fails, so they aren't downloaded again
+            for path, future in zip(paths, futures):
+                try:
+                    index["archives"][path[5:]] = future.result()
+                except Exception as e:
+                    error = error or e
+
+        self.save_index(index)
+
+        if error is not None:
+            raise error
+
+    def __download_file(self, path: str, validators: dict = None):
+        """Downloads single file from provided path, see download_data method.
+
+        Parameters:
+            path : str
+                String representing path to file on police department server.
+            validators : dict of (str, str), optional, default: None
+                ETag and Last-Modified headers of already downloaded file, if None, file is downloaded unconditionally.
+
+        Returns:
+            dict of (str, str)
+                ETag and Last-Modified headers of downloaded file.
+        """
+        filename = self.folder + os.path.sep + path[5:]
+        part_filename = filename + '.part'
+        headers = {}
+        part_validators = None
+
+        if os.path.isfile(part_filename) and os.path.isfile(part_filename + '.json'):
+            # Resume interrupted download, if file changed on server in between, whole file is sent (If-Range)
+            with open(part_filename + '.json', 'r') as f:
+                part_validators = json.load(f)
+            if part_validators["etag"] or part_validators["last_modified"]:
+                headers['Range'] = 'bytes=' + str(os.path.getsize(part_filename)) + '-'
+                headers['If-Range'] = part_validators["etag"] or part_validators["last_modified"]
+        elif os.path.isfile(filename) and validators:
+            if validators["etag"]:
+                headers['If-None-Match'] = validators["etag"]
+            if validators["last_modified"]:
+                headers['If-Modified-Since'] = validators["last_modified"]
+
+        self.metrics.event("download", path[5:], url=self.url + path, resume='Range' in headers)
+        with self.__session.get(self.url + path, headers=headers, stream=True, timeout=60) as resp:
+            if resp.status_code == 304:
+                self.metrics.count("files_not_modified")
+                return validators
+
+            if resp.status_code == 416 and 'Range' in headers:
+                # Range starts at the end of file, so part was downloaded completely (only not renamed), if its size
+                # matches size of file on server (Content-Range: bytes */size), otherwise it's downloaded again
+                total = resp.headers.get('Content-Range', '').rpartition('/')[2]
+                if total != str(os.path.getsize(part_filename)):
+                    os.remove(part_filename)
+                    os.remove(part_filename + '.json')
+                    return self.__download_file(path, validators)
+                validators = part_validators
+            else:
+                resp.raise_for_status()
+
+                validators = {"etag": resp.headers.get('ETag'), "last_modified": resp.headers.get('Last-Modified')}
+                if resp.status_code != 206:
+                    with open(part_filename + '.json', 'w') as f:
+                        json.dump(validators, f)
+
+                with open(part_filename, 'ab' if resp.status_code == 206 else 'wb') as file:
+                    for chunk in resp.iter_content(chunk_size=1_048_576):
                         file.write(chunk)
+                        self.metrics.count("bytes_downloaded", len(chunk))
+
+        self.metrics.count("files_downloaded")
+
+        os.replace(part_filename, filename)
+        os.remove(part_filename + '.json')
+
+        return validators
+
+    def load_index(self):
+        """Loads index file of downloaded data.
+
+        Returns:
+            dict
+                Index with key 'archives', holding 'file name : dict of ETag and Last-Modified headers' and key 'paths',
+                holding list of paths to files on police department server.
+        """
+        try:
+            with open(self.folder + os.path.sep + self.index_filename, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"archives": {}}
+
+    def save_index(self, index: dict):
+        """Saves index file of downloaded data, see load_index method.
+
+        Parameters:
+            index : dict
+                Saved index.
+        """
+        with open(self.folder + os.path.sep + self.index_filename + '.tmp', 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(self.folder + os.path.sep + self.index_filename + '.tmp', self.folder + os.path.sep +
+                   self.index_filename)
 
-    def parse_region_data(self, region: str):
+    def parse_region_data(self, region: str, engine: str = "numpy"):
         """From all downloaded files in folder loads and parses data for specified region.
 
         Parameters:
             region : str
                 Region tag.
                 One of the keys from class attribute dictionary regions.
+            engine : str, optional, default: "numpy"
+                Parser engine, one of class attribute engines.
+                "numpy" reads whole CSV files at once and converts data column by column.
+                "python" parses CSV files row by row, it's slow and kept as reference implementation.
+
+                If engine isn't one of class attribute engines, method halts the script run.
+
+        Returns:
+            dict of numpy.ndarray
+                Dictionary with parsed data for set region.
+        """
+        if engine == "numpy":
+            return self.parse_regions_data([region])[region]
+        elif engine == "python":
+            with self.metrics.stage("parse_python", region=region):
+                region_data = self.__parse_region_data_python(region)
+            self.metrics.count("rows_parsed", region_data[self.headers[0]].size, region)
+            return region_data
+        else:
+            print('Invalid parser engine', file=sys.stderr)
+            exit(-1)
+
+    def parse_regions_data(self, regions: list, paths: list = None):
+        """From all downloaded files in folder loads and parses data for specified regions with "numpy" parser engine.
+
+        Each downloaded archive is opened only once, CSV files of all the regions are read during this single visit.
+
+        Parameters:
+            regions : list of str
+                Region tags.
+                Keys from class attribute dictionary regions.
+            paths : list of str, optional, default: None
+                Paths (from paths attribute) of parsed files, if None, all the files are parsed.
+
+        Returns:
+            dict of (str, dict of numpy.ndarray)
+                Region tag : dictionary with parsed data for the region.
+        """
+        return {region: self.merge_region_data(list(region_data_parts.values()))
+                for region, region_data_parts in self.__parse_regions_parts(regions, paths).items()}
+
+    def __parse_regions_parts(self, regions: list, paths: list = None):
+        """Parses data for specified regions, see parse_regions_data method, data of each file are kept separately.
+
+        Parameters:
+            regions : list of str
+                Region tags.
+            paths : list of str, optional, default: None
+                Paths (from paths attribute) of parsed files, if None, all the files are parsed.
+
+        Returns:
+            dict of (str, dict of (str, dict of numpy.ndarray))
+                Region tag : path : dictionary with parsed data for the region from the file.
+        """
+        if paths is None:
+            paths = self.paths
+
+        regions_data_parts = {region: {} for region in regions}
+
+        with self.metrics.stage("parse", regions=len(regions), files=len(paths)):
+            for path in paths:
+                with zipfile.ZipFile(self.folder + os.path.sep + path[5:], 'r') as zipf:
+                    for region in regions:
+                        with self.metrics.stage("read_csv", region=region):
+                            frame = self.__read_csv(zipf.read(self.regions[region] + '.csv'))
+                        with self.metrics.stage("convert", region=region):
+                            regions_data_parts[region][path] = self.__convert_region_frame(frame, region)
+                        self.metrics.count("rows_parsed", len(frame.index), region)
+                self.metrics.count("files_parsed")
+
+        return regions_data_parts
+
+    def archive_fingerprint(self, path: str, sha1: bool = True):
+        """Makes fingerprint of downloaded file, used for detecting new or changed files.
+
+        Parameters:
+            path : str
+                Path (from paths attribute) of the file.
+            sha1 : bool, optional, default: True
+                If true, fingerprint contains SHA-1 hash of file content, which requires reading whole file.
+
+        Returns:
+            dict
+                Fingerprint with keys 'name', 'size', 'mtime' (in nanoseconds) and optionally 'sha1'.
+        """
+        filename = self.folder + os.path.sep + path[5:]
+        stat = os.stat(filename)
+        fingerprint = {"name": path[5:], "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+        if sha1:
+            digest = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                while chunk := f.read(1_048_576):
+                    digest.update(chunk)
+            fingerprint["sha1"] = digest.hexdigest()
+
+        return fingerprint
+
+    def __csv_options(self, usecols: list = None):
+        """Makes arguments of pandas.read_csv, with which columns are converted natively by CSV parser, according to
+        schema module.
+
+        Numeric columns are parsed as numbers (decimal comma for "float" columns), empty values and 'XX' are nan, so
+        __convert_region_frame method only replaces nan with null values, validates times and casts to data types of
+        schema. Parser infers their types instead of getting them, so column with other invalid value is kept as
+        strings and converted by __convert_region_frame method. "str" columns are read as pandas.Categorical with empty
+        values kept, dates are read as strings.
+
+        Parameters:
+            usecols : list of int, optional, default: None
+                Numbers of read columns, if None, all the columns are read.
+
+        Returns:
+            dict
+                Keyword arguments of pandas.read_csv.
+        """
+        dtype, na_values = {}, {}
+        for i, column in enumerate(schema.COLUMNS[:len(self.headers)]):
+            if usecols is not None and i not in usecols:
+                continue
+            if column.parser == "str":
+                dtype[i] = "category"
+            elif column.parser == "date":
+                dtype[i] = str
+            else:
+                na_values[i] = ['', 'XX']
+
+        return {"sep": ';', "encoding": 'cp1250', "header": None, "decimal": ',', "dtype": dtype,
+                "na_values": na_values, "keep_default_na": False, "usecols": usecols}
+
+    def __read_csv(self, raw: bytes):
+        """Reads raw CSV file content into pandas.DataFrame, columns are converted by CSV parser, see __csv_options
+        method.
+
+        Parameters:
+            raw : bytes
+                Content of CSV file from police department server (cp1250, ';' delimited).
+
+        Returns:
+            pandas.DataFrame
+                Data frame with columns numbered from 0 as in CSV file.
+        """
+        if not raw.strip():
+            return pd.DataFrame({i: pd.Series([], dtype=str) for i in range(len(self.headers))})
+
+        return pd.read_csv(io.BytesIO(raw), **self.__csv_options(list(range(len(self.headers)))))
+
+    def __read_csv_chunks(self, file, chunksize: int, usecols: list):
+        """Reads CSV file from police department server by chunks, see __read_csv method.
+
+        Parameters:
+            file : file object
+                Opened CSV file (cp1250, ';' delimited).
+            chunksize : int
+                Maximal number of rows in chunk.
+            usecols : list of int
+                Numbers of read columns.
+
+        Yields:
+            pandas.DataFrame
+                Data frame with read columns numbered as in CSV file.
+        """
+        try:
+            yield from pd.read_csv(file, chunksize=chunksize, **self.__csv_options(usecols))
+        except pd.errors.EmptyDataError:
+            return
+
+    def __convert_region_frame(self, frame: pd.DataFrame, region: str, columns: list = None):
+        """Converts CSV data frame read by __read_csv method to dictionary of numpy.ndarray with correct data types.
+
+        Conversions are done for whole columns at once, results are same as from "python" parser engine.
+
+        Parameters:
+            frame : pandas.DataFrame
+                Data frame with CSV data of single region.
+            region : str
+                Region tag.
+            columns : list of str, optional, default: None
+                Keys of converted columns, if None, all the columns are converted.
+
+        Returns:
+            dict of numpy.ndarray
+                Dictionary with parsed data for set region.
+        """
+        region_data_arrays = {key: value for key, value in self.init_region_data_dict().items()
+                              if not columns or key in columns}
+
+        for i, column in enumerate(schema.COLUMNS):
+            if column.name not in region_data_arrays:
+                continue
+
+            if column.parser in ["int", "float", "time"]:
+                # Column with invalid values isn't parsed by CSV parser, it's parsed from strings, invalid values and
+                # times are nan
+                values = schema.as_numbers(column.name, frame[i])
+                if column.parser == "float":
+                    values = values.astype(column.dtype)
+                else:
+                    # Empty or invalid values are replaced with null value
+                    values = np.where(np.isnan(values), column.null, values).astype(column.dtype)
+            elif column.parser == "str":
+                values = frame[i].array if isinstance(frame[i].dtype, pd.CategoricalDtype) else \
+                    pd.Categorical(frame[i].to_numpy())
+            elif column.parser == "date":
+                # Dates in YYYY-MM-DD format, invalid values are replaced with NaT
+                values = pd.to_datetime(frame[i], format='%Y-%m-%d', errors='coerce').to_numpy().astype(column.dtype)
+            else:
+                values = np.full(len(frame.index), region, column.dtype)
+
+            region_data_arrays[column.name] = values
+
+        return region_data_arrays
+
+    def __parse_region_data_python(self, region: str):
+        """Parses data for specified region row by row, used as reference implementation of parser.
+
+        Parameters:
+            region : str
+                Region tag.
 
         Returns:
             dict of numpy.ndarray
@@ -195,34 +719,68 @@ class DataDownloader:
         # Create numpy arrays with correct data types from lists
         region_data_arrays = self.init_region_data_dict()
         for key, value in region_data_arrays.items():
-            region_data_arrays[key] = np.concatenate(
-                [region_data_arrays[key], np.array(region_data_lists[key], value.dtype)]
-            )
+            if isinstance(value, pd.Categorical):
+                region_data_arrays[key] = pd.Categorical(region_data_lists[key])
+            else:
+                region_data_arrays[key] = np.array(region_data_lists[key], value.dtype)
 
         return region_data_arrays
 
     def init_region_data_dict(self):
-        """Creates dictionary as 'header of CSV : empty Numpy Array' with correct numpy data types, needed for each
-        region parsed data.
+        """Creates dictionary as 'header of CSV : empty Numpy Array' with numpy data types from schema module, needed
+        for each region parsed data.
 
         Returns:
             dict of numpy.ndarray
                 'header of CSV : empty Numpy Array'
         """
-        data_types = [np.ulonglong, np.ubyte, np.int_, 'datetime64[D]', np.ubyte, np.short, np.ubyte, np.ubyte,
-                      np.ubyte, np.ubyte, np.ubyte, np.ubyte, np.ushort, np.ubyte, np.ubyte, np.ubyte, np.int_,
-                      np.ubyte, np.ubyte, np.ubyte, np.ubyte, np.ubyte, np.ubyte, np.ubyte, np.ubyte, np.ubyte,
-                      np.ubyte, np.ubyte, np.ubyte, np.ubyte, np.ubyte, np.byte, np.ubyte, np.byte, np.byte,
-                      np.byte, np.byte, np.byte, np.byte, np.byte, np.byte, np.int_, np.byte, np.byte, np.byte,
-                      np.single, np.single, np.single, np.single, np.single, np.single, 'U60', 'U60', 'a10',
-                      'U30', 'U40', 'a30', 'a20', 'U30', 'U30', np.int_, np.int_, 'a40', np.byte, 'a3']
+        return schema.empty_arrays()
+
+    def __check_arguments(self, regions: list = None, columns: list = None, where: dict = None):
+        """Checks arguments of get_dict and iter_batches methods and replaces missing ones with defaults.
+
+        If any of regions isn't key from class attribute dictionary regions, or any of columns or keys of where isn't
+        CSV header nor 'region', method halts the script run.
 
-        for i in range(len(data_types)):
-            data_types[i] = np.array([], data_types[i])
+        Parameters:
+            regions : list of str, optional, default: None
+                Regions, if None, all the regions.
+            columns : list of str, optional, default: None
+                Columns, if None, all the columns.
+            where : dict, optional, default: None
+                Condition for rows, if None, empty condition.
 
-        return dict(zip(self.headers + ['region'], data_types))
+        Returns:
+            tuple of (list of str, list of str, dict, list of str)
+                Regions, columns, condition and needed columns (columns, columns of condition and accident ID, p1) in
+                order of schema.
+        """
+        if not regions:
+            regions = list(self.regions.keys())
 
-    def get_dict(self, regions: list = None):
+        for region in regions:
+            if region not in list(self.regions.keys()):
+                print('Invalid region name', file=sys.stderr)
+                exit(-1)
+
+        if not columns:
+            columns = self.headers + ["region"]
+
+        if not where:
+            where = {}
+
+        for column in [*columns, *where]:
+            if column not in self.headers + ["region"]:
+                print('Invalid column name', file=sys.stderr)
+                exit(-1)
+
+        needed = [key for key in self.headers + ["region"] if key in columns or key in where or key == self.headers[0]]
+
+        return regions, columns, where, needed
+
+    @_stage("get_dict")
+    def get_dict(self, regions: list = None, workers: int = None, columns: list = None, where: dict = None,
+                 keep: str = "first"):
         """Gets parsed data for provided regions, joined in one dictionary
 
         Parameters:
@@ -232,61 +790,493 @@ class DataDownloader:
 
                 If any of strings isn't key from class attribute dictionary regions, method halts the script run.
                 If None, all the regions are parsed.
+            workers : int, optional, default: None
+                Number of processes used for parsing regions, which aren't cached yet. Each process saves cache file
+                of region it parsed, main process only joins the data.
+                If None or 1, regions are parsed one by one in main process.
+            columns : list of str, optional, default: None
+                List containing keys of returned dictionary (CSV headers or 'region'). Only these columns are read
+                from cache.
+
+                If any of strings isn't CSV header nor 'region', method halts the script run.
+                If None, all the columns are returned.
+            where : dict, optional, default: None
+                Condition for rows of each region, applied before regions are joined, see where_mask method.
+                Columns used in condition don't have to be in columns.
+
+                If any of keys isn't CSV header nor 'region', method halts the script run.
+                If None, all the rows are returned.
+            keep : str, optional, default: "first"
+                Which one of rows with same accident ID (p1) is kept, "first" or "last" (in order of regions and
+                rows), other rows are removed.
+
+                If keep is neither "first" nor "last", method halts the script run.
 
         Returns:
             dict of numpy.ndarray
                 Joined dictionaries returned by calling parse_region_data(region) method by scheme:
                 'dictN_header (always same) : concatenated numpy.ndarray(s)'.
         """
-        if not regions:
-            regions = list(self.regions.keys())
+        # Only needed columns are loaded, accident ID (p1) is always needed for removing duplicates
+        regions, columns, where, needed = self.__check_arguments(regions, columns, where)
+
+        # Load cached regions, which were built from current files, paths are resolved before worker processes are
+        # started. Regions in memory without some of needed columns are loaded again (only missing columns).
+        pending = [region for region in regions
+                   if not self.__cache[region] or any(key not in self.__cache[region] for key in needed)]
+        if pending and self.__paths is None:
+            self.resolve_paths()
 
         for region in regions:
-            if region not in list(self.regions.keys()):
-                print('Invalid region name', file=sys.stderr)
-                exit(-1)
+            self.metrics.count("memory_cache_miss" if region in pending else "memory_cache_hit", region=region)
+
+        outdated = []
+        for region in pending:
+            manifest, sources, paths = self.cache_plan(region)
+            if not paths and manifest is not None and len(sources) == len(manifest["sources"]) and \
+                    (region_data := self.load_dict_cache(region, [key for key in needed
+                                                                  if key not in (self.__cache[region] or {})])):
+                self.__cache[region] = {**(self.__cache[region] or {}), **region_data}
+                self.metrics.count("disk_cache_hit", region=region)
+            else:
+                outdated.append(region)
+                self.metrics.count("disk_cache_miss", region=region)
 
-        # Initialize dict(header:np.ndarray(empty)) for concatenation
-        regions_data = self.init_region_data_dict()
+        # Parse regions, which aren't cached, cached regions are only updated with data from new or changed files
+        if workers and workers > 1 and len(outdated) > 1:
+            # Every worker gets its own group of regions and visits each archive once for the whole group
+            workers = min(workers, len(outdated))
+            groups = [outdated[i::workers] for i in range(workers)]
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                for regions_data, snapshot in executor.map(_update_dict_cache, [self] * workers, groups):
+                    self.__cache.update(regions_data)
+                    self.metrics.merge(snapshot)
+        elif outdated:
+            self.__cache.update(self.update_dict_cache(outdated))
+
+        regions_data = [self.__cache[region] for region in regions]
+        masks = [self.where_mask(region_data, where) if where else None for region_data in regions_data]
+
+        # Remove duplicates, rows are found by accident ID (p1) of all joined rows (before condition is applied, so
+        # the result is same as filtered result without condition) and removed by masks during joining
+        with self.metrics.stage("dedup"):
+            ids = self.merge_region_data(regions_data, columns=[self.headers[0]])[self.headers[0]]
+            keep_mask = ~self.duplicates_mask(ids, keep)
+            if not keep_mask.all():
+                sizes = [region_data[self.headers[0]].size for region_data in regions_data]
+                for i, region_keep_mask in enumerate(np.split(keep_mask, np.cumsum(sizes)[:-1])):
+                    masks[i] = region_keep_mask if masks[i] is None else masks[i] & region_keep_mask
+            self.metrics.count("duplicates_removed", int(keep_mask.size - np.count_nonzero(keep_mask)))
+
+        with self.metrics.stage("merge"):
+            return self.merge_region_data(regions_data, masks, columns)
+
+    def iter_batches(self, regions: list = None, batch_size: int = 100_000, columns: list = None, where: dict = None,
+                     as_frame: bool = False):
+        """Reads data for provided regions straight from downloaded files and yields them by batches, so the whole
+        data are never held in memory. Cache is not used.
+
+        Joined batches are same as result of get_dict method with same arguments (keep="first"). Rows with already
+        seen accident ID (p1) are skipped, only accident IDs are remembered between batches. So memory is bounded by
+        batch_size plus 8 bytes for each unique accident ID read so far (it can't be less, as any of them can appear
+        again), see _IdSet class.
+
+        Parameters:
+            regions : list of str, optional, default: None
+                Regions, see get_dict method.
+            batch_size : int, optional, default: 100_000
+                Number of rows in each batch, except the last one.
+            columns : list of str, optional, default: None
+                Columns, see get_dict method.
+            where : dict, optional, default: None
+                Condition for rows, see get_dict method.
+            as_frame : bool, optional, default: False
+                If true, batches are yielded as pandas.DataFrame.
+
+        Yields:
+            dict of numpy.ndarray or pandas.DataFrame
+                Batch of data.
+        """
+        # Read and converted columns, accident ID (p1) is always needed for removing duplicates
+        regions, columns, where, keys = self.__check_arguments(regions, columns, where)
+        usecols = [i for i, header in enumerate(self.headers) if header in keys]
+
+        def batch(data: dict, stop: int):
+            batch_data = {key: values[:stop] for key, values in data.items() if key in columns}
+            return pd.DataFrame(batch_data) if as_frame else batch_data
+
+        seen_ids = _IdSet()
+        buffer, buffered = [], 0
 
         for region in regions:
-            if region_data := self.__cache[region]:
-                pass
-            elif region_data := self.load_dict_cache(region):
-                self.__cache[region] = region_data
+            for path in self.paths:
+                with zipfile.ZipFile(self.folder + os.path.sep + path[5:], 'r') as zipf:
+                    with zipf.open(self.regions[region] + '.csv', 'r') as csvf:
+                        for frame in self.__read_csv_chunks(csvf, batch_size, usecols):
+                            data = self.__convert_region_frame(frame, region, keys)
+
+                            # Skip duplicates and rows not matching condition, duplicates are found among all the
+                            # rows (same as in get_dict method)
+                            ids = data[self.headers[0]]
+                            mask = ~self.duplicates_mask(ids)
+                            mask &= ~seen_ids.contains(ids)
+                            seen_ids.add(ids[mask])
+                            if where:
+                                mask &= self.where_mask(data, where)
+
+                            buffer.append(data if mask.all() else {key: values[mask] for key, values in data.items()})
+                            buffered += int(np.count_nonzero(mask))
+
+                            while buffered >= batch_size:
+                                data = self.merge_region_data(buffer, columns=keys)
+                                yield batch(data, batch_size)
+                                buffer = [{key: values[batch_size:] for key, values in data.items()}]
+                                buffered -= batch_size
+
+        if buffered:
+            yield batch(self.merge_region_data(buffer, columns=keys), buffered)
+
+    def merge_region_data(self, regions_data: list, masks: list = None, columns: list = None):
+        """Joins dictionaries with data of regions into one dictionary.
+
+        Each joined column is allocated only once, with size given by row counts of joined dictionaries, and filled in
+        place, so there are no copies in between.
+
+        Parameters:
+            regions_data : list of dict of numpy.ndarray
+                Joined dictionaries.
+            masks : list of numpy.ndarray, optional, default: None
+                Boolean masks of rows taken from each joined dictionary, None in list means all the rows.
+                If None, all the rows are taken from every dictionary.
+            columns : list of str, optional, default: None
+                Keys of joined columns. If None, all the columns are joined.
+
+        Returns:
+            dict of numpy.ndarray
+                Joined dictionary.
+        """
+        template = {key: value for key, value in self.init_region_data_dict().items() if not columns or key in columns}
+
+        if not masks:
+            masks = [None] * len(regions_data)
+
+        first_key = next(iter(template))
+        sizes = [len(region_data[first_key]) if mask is None else int(np.count_nonzero(mask))
+                 for region_data, mask in zip(regions_data, masks)]
+
+        # Dictionary encoded columns are joined as codes, categories of joined column are union of all the categories
+        categories = {key: pd.Index(np.concatenate([np.array([], object)] + [
+            region_data[key].categories.to_numpy(object) for region_data in regions_data])).unique()
+            for key, value in template.items() if isinstance(value, pd.Categorical)}
+
+        merged_data = {key: np.empty(sum(sizes), schema.COLUMNS_BY_NAME[key].dtype if key in categories else
+                                     value.dtype) for key, value in template.items()}
+
+        start = 0
+        for region_data, mask, size in zip(regions_data, masks, sizes):
+            for key, values in merged_data.items():
+                if key in categories:
+                    # Codes of region are translated to codes of joined categories, missing value code -1 stays -1
+                    lookup = np.append(categories[key].get_indexer(region_data[key].categories), -1)
+                    codes = region_data[key].codes if mask is None else region_data[key].codes[mask]
+                    values[start:start + size] = lookup[codes]
+                elif mask is None:
+                    values[start:start + size] = region_data[key]
+                else:
+                    np.compress(mask, region_data[key], out=values[start:start + size])
+            start += size
+
+        for key in categories:
+            merged_data[key] = pd.Categorical.from_codes(merged_data[key], categories[key])
+
+        return merged_data
+
+    @staticmethod
+    def duplicates_mask(ids: np.ndarray, keep: str = "first"):
+        """Finds duplicate values with single pass over hash table, without sorting.
+
+        Parameters:
+            ids : numpy.ndarray
+                Values, in which duplicates are searched, e.g. accident IDs (p1).
+            keep : str, optional, default: "first"
+                "first" marks all the occurrences of value except the first one, "last" all except the last one.
+
+                If keep is neither "first" nor "last", method halts the script run.
+
+        Returns:
+            numpy.ndarray
+                Boolean mask of duplicate rows.
+        """
+        if keep not in ["first", "last"]:
+            print('Invalid keep value', file=sys.stderr)
+            exit(-1)
+
+        return pd.Series(ids).duplicated(keep).to_numpy()
+
+    @staticmethod
+    def where_mask(data: dict, where: dict):
+        """Makes boolean mask of rows, which fulfill all the conditions.
+
+        Condition for a column can be:
+            set (or list) of values, column value has to be one of them, e.g. {"p36": {0, 1}},
+            tuple (low, high), column value has to be in range low <= value < high, None means unbounded,
+                e.g. {"p2a": ("2018-01-01", "2021-01-01")},
+            single value, column value has to be equal to it, e.g. {"p9": 1}.
+        Values are converted to data type of column, so dates and regions can be given as strings.
+
+        Parameters:
+            data : dict of numpy.ndarray
+                Data with all the columns used in conditions.
+            where : dict
+                Column name : condition.
+
+        Returns:
+            numpy.ndarray
+                Boolean mask of rows.
+        """
+        mask = np.ones(data[next(iter(data))].size, np.bool_)
+
+        for column, condition in where.items():
+            values = data[column]
+
+            if isinstance(values, pd.Categorical):
+                if isinstance(condition, tuple):
+                    values = np.asarray(values, str)
+                else:
+                    # Dictionary encoded column is compared by codes of matching categories
+                    codes = values.categories.get_indexer(
+                        list(condition) if isinstance(condition, (set, frozenset, list)) else [condition])
+                    mask &= np.isin(values.codes, codes[codes >= 0])
+                    continue
+
+            if isinstance(condition, (set, frozenset, list)):
+                mask &= np.isin(values, np.array(list(condition)).astype(values.dtype))
+            elif isinstance(condition, tuple):
+                low, high = condition
+                if low is not None:
+                    mask &= values >= np.array(low).astype(values.dtype)
+                if high is not None:
+                    mask &= values < np.array(high).astype(values.dtype)
             else:
-                region_data = self.parse_region_data(region)
-                self.save_dict_cache(region, region_data)
-                self.__cache[region] = region_data
+                mask &= values == np.array(condition).astype(values.dtype)
+
+        return mask
+
+    @_stage("cache_plan")
+    def cache_plan(self, region: str):
+        """Compares files, from which region cache was built, with current files in paths attribute.
+
+        Files are compared by size and modification time, SHA-1 hash is computed only if these differ. If hash of file
+        with other size or modification time (e.g. touched or copied file) is same, its new size and modification time
+        are stored in manifest, so it isn't hashed again next time.
+
+        Parameters:
+            region : str
+                Region tag.
+
+        Returns:
+            tuple of (dict, list of dict, list of str)
+                Cache manifest (None if there is no cache), sources (files fingerprints with row counts) still valid
+                in cache and paths of new or changed files, which have to be parsed. Cache is up to date, if there are
+                no paths to be parsed and all the sources are still valid.
+                Cache made by older versions of this script (without sources, or pickle gzip file), from which it's
+                not known which files it contains, and cache with other data types than in schema module are parsed
+                again from all the files, so they are rebuilt once with sources.
+        """
+        manifest = self.load_cache_manifest(region)
 
-            for key in region_data:
-                regions_data[key] = np.concatenate([regions_data[key], region_data[key]])
+        if manifest is not None and any(column["dtype"] != schema.COLUMNS_BY_NAME[key].dtype.str
+                                        for key, column in manifest["columns"].items()):
+            return None, [], list(self.paths)
 
-        # Remove duplicates
-        unique, counts = np.unique(regions_data[self.headers[0]], return_counts=True)
-        indices = np.argwhere(np.subtract(counts, np.ones_like(counts)))
-        for header in self.headers + ["region"]:
-            regions_data[header] = np.delete(regions_data[header], list(indices))
+        if manifest is None or "sources" not in manifest:
+            return None, [], list(self.paths)
+
+        current = {path[5:]: path for path in self.paths}
+        sources, refreshed = [], False
+
+        for i, source in enumerate(manifest["sources"]):
+            if (path := current.get(source["name"])) is None:
+                continue
+
+            fingerprint = self.archive_fingerprint(path, False)
+            if (fingerprint["size"], fingerprint["mtime"]) == (source["size"], source["mtime"]):
+                sources.append(source)
+            elif self.archive_fingerprint(path)["sha1"] == source["sha1"]:
+                manifest["sources"][i] = {**source, "size": fingerprint["size"], "mtime": fingerprint["mtime"]}
+                sources.append(manifest["sources"][i])
+                refreshed = True
+
+        if refreshed:
+            self.save_cache_manifest(region, manifest)
+
+        names = [source["name"] for source in sources]
+
+        return manifest, sources, [path for path in self.paths if path[5:] not in names]
+
+    @_stage("update_cache")
+    def update_dict_cache(self, regions: list):
+        """Parses data of regions and saves them to cache. If region is already cached, only new or changed files are
+        parsed and joined with data of unchanged files from cache, see cache_plan method.
+
+        Parameters:
+            regions : list of str
+                Region tags.
+
+        Returns:
+            dict of (str, dict of numpy.ndarray)
+                Region tag : dictionary with data for the region.
+        """
+        plans = {region: self.cache_plan(region) for region in regions}
+
+        # Files needed by any region are parsed for all the regions at once
+        paths = [path for path in self.paths if any(path in plan[2] for plan in plans.values())]
+        regions_data_parts = self.__parse_regions_parts(regions, paths)
+        fingerprints = {path: self.archive_fingerprint(path) for path in paths}
+
+        regions_data = {}
+        for region, (manifest, sources, region_paths) in plans.items():
+            region_data_parts, region_sources = [], []
+
+            # Rows of unchanged files are sliced from cache, rows of each file are stored in cache in order of sources
+            cached, offsets = None, {}
+            if manifest and sources:
+                cached = self.load_dict_cache(region)
+                start = 0
+                for source in manifest["sources"]:
+                    offsets[source["name"]] = (start, start + source["rows"])
+                    start += source["rows"]
+            unchanged = {source["name"]: source for source in sources}
+
+            # Parts are joined in order of paths, so the cache is same as cache parsed from all the files
+            for path in self.paths:
+                if path in region_paths:
+                    region_data_parts.append(regions_data_parts[region][path])
+                    region_sources.append({**fingerprints[path], "rows": region_data_parts[-1][self.headers[0]].size})
+                elif cached and path[5:] in unchanged:
+                    start, stop = offsets[path[5:]]
+                    region_data_parts.append({key: values[start:stop] for key, values in cached.items()})
+                    region_sources.append(unchanged[path[5:]])
+
+            regions_data[region] = self.merge_region_data(region_data_parts)
+            self.save_dict_cache(region, regions_data[region], region_sources)
 
         return regions_data
 
-    def save_dict_cache(self, region: str, region_data: dict):
-        """Caches dictionary to file with pickle gzip format. File is named as cache_filename with replaced '{}' for
-        region tag
+    @_stage("save_cache")
+    def save_dict_cache(self, region: str, region_data: dict, sources: list = None):
+        """Caches dictionary to folder named as cache_filename with replaced '{}' for region tag. Each column is saved
+        as separate numpy file (.npy), dictionary encoded columns (pandas.Categorical) as codes file and categories
+        file. File 'manifest.json' holds row count and file names and data type (from schema module) of each column.
 
-        compresslevel = 1
+        Codes are saved with data type, which pandas uses for their number of categories (never wider than data type in
+        schema), so they can be memory mapped by load_dict_cache method without conversion.
+
+        Files are saved by save_columns function, so the cache interrupted during saving is never loaded.
 
         Parameters:
             region : str
-                Region tag used for file naming.
+                Region tag used for folder naming.
             region_data : dict of numpy.ndarray
                 Cached data.
+            sources : list of dict, optional, default: None
+                Fingerprints of files (see archive_fingerprint method) with row counts ('rows'), from which data were
+                parsed, in order of rows.
         """
-        with gzip.open(self.folder + os.path.sep + re.sub('{}', region, self.cache_filename, 1), 'wb', 1) as f:
-            pkl.dump(region_data, f)
+        manifest, files = {"rows": 0, "columns": {}}, {}
+        for key, values in region_data.items():
+            filename = re.sub(r'\W', '_', key)
+            manifest["rows"] = len(values)
+            manifest["columns"][key] = {"file": filename + '.npy'}
 
-    def load_dict_cache(self, region: str):
-        """Loads cached dictionary from pickle gzip format file for corresponding region
+            # Dictionary encoded columns are saved as codes and categories
+            if isinstance(values, pd.Categorical):
+                files[filename + '.categories.npy'] = values.categories.to_numpy(str)
+                manifest["columns"][key]["categories"] = filename + '.categories.npy'
+                manifest["columns"][key]["dtype"] = schema.COLUMNS_BY_NAME[key].dtype.str
+                values = values.codes
+            else:
+                manifest["columns"][key]["dtype"] = values.dtype.str
+
+            files[filename + '.npy'] = values
+
+        if sources is not None:
+            manifest["sources"] = sources
+
+        save_columns(self.folder + os.path.sep + re.sub('{}', region, self.cache_filename, 1), files, manifest)
+        self.metrics.count("rows_cached", manifest["rows"], region)
+
+    def save_cache_manifest(self, region: str, manifest: dict):
+        """Saves manifest of region cache, see save_dict_cache method and save_manifest function.
+
+        Parameters:
+            region : str
+                Region tag.
+            manifest : dict
+                Saved manifest.
+        """
+        save_manifest(self.folder + os.path.sep + re.sub('{}', region, self.cache_filename, 1), manifest)
+
+    def load_cache_manifest(self, region: str):
+        """Loads manifest of region cache, see save_dict_cache method.
+
+        Parameters:
+            region : str
+                Region tag.
+
+        Returns:
+            dict
+                Manifest, None if region isn't cached.
+        """
+        return load_manifest(self.folder + os.path.sep + re.sub('{}', region, self.cache_filename, 1))
+
+    @_stage("load_cache")
+    def load_dict_cache(self, region: str, columns: list = None):
+        """Loads cached dictionary from folder for corresponding region. Columns are memory mapped, so data are read
+        from disk only when accessed, also codes of dictionary encoded columns stay memory mapped (they aren't
+        validated).
+
+        If there is no cache folder, but there is pickle gzip file made by older versions of this script, the file is
+        loaded and converted to new cache format.
+
+        Parameters:
+            region : str
+                Region tag determining for which region load data.
+            columns : list of str, optional, default: None
+                Keys of loaded columns. If None, all the columns are loaded.
+
+        Returns:
+            dict of numpy.ndarray
+                Loaded data in dictionary from memory.
+        """
+        cache_folder = self.folder + os.path.sep + re.sub('{}', region, self.cache_filename, 1)
+
+        if (manifest := self.load_cache_manifest(region)) is None:
+            if not (region_data := self.load_legacy_dict_cache(region)):
+                return False
+
+            self.metrics.count("legacy_cache_converted", region=region)
+            region_data = {key: schema.as_column(key, values) for key, values in region_data.items()}
+            self.save_dict_cache(region, region_data)
+            return {key: value for key, value in region_data.items() if not columns or key in columns}
+
+        region_data = {}
+        for key, column in manifest["columns"].items():
+            if not columns or key in columns:
+                region_data[key] = np.load(cache_folder + os.path.sep + column["file"], mmap_mode='r',
+                                           allow_pickle=False)
+                if "categories" in column:
+                    # Codes were saved from valid pandas.Categorical, caches of older versions (codes with data type
+                    # from schema) are converted in memory
+                    dtype = pd.CategoricalDtype(np.load(cache_folder + os.path.sep + column["categories"],
+                                                        allow_pickle=False))
+                    region_data[key] = pd.Categorical.from_codes(region_data[key], dtype=dtype, validate=False)
+
+        return region_data
+
+    def load_legacy_dict_cache(self, region: str):
+        """Loads cached dictionary from pickle gzip format file for corresponding region, made by older versions of this
+        script.
 
         compresslevel = 1
 
@@ -299,14 +1289,88 @@ class DataDownloader:
                 Loaded data in dictionary from memory.
         """
         try:
-            with gzip.open(self.folder + os.path.sep + re.sub('{}', region, self.cache_filename, 1), 'rb', 1) as f:
+            with gzip.open(self.folder + os.path.sep + re.sub('{}', region, self.legacy_cache_filename, 1), 'rb',
+                           1) as f:
                 return pkl.load(f)
         except FileNotFoundError:
             return False
 
 
+class _IdSet:
+    """Class for set of integer IDs growing by batches, used by DataDownloader.iter_batches method
+
+    IDs are kept in sorted runs with sizes decreasing at least by half, added batch is sorted and merged with smaller
+    runs (like carries of binary counter). So there are O(log n) runs, each ID is merged O(log n) times and set takes 8
+    bytes per ID (temporarily twice the largest run during its merge), whole set is never sorted again.
+
+    Attributes
+        __runs : list of numpy.ndarray [Instance Attribute]
+            Sorted runs of IDs, from the largest.
+    """
+
+    def __init__(self):
+        self.__runs = []
+
+    def contains(self, ids: np.ndarray):
+        """Finds IDs present in set.
+
+        Parameters:
+            ids : numpy.ndarray
+                Searched IDs.
+
+        Returns:
+            numpy.ndarray
+                Boolean mask of IDs present in set.
+        """
+        # Searching sorted IDs visits runs in order, which is much faster for large runs
+        order = np.argsort(ids)
+        ids = ids[order]
+
+        found = np.zeros(ids.size, np.bool_)
+        for run in self.__runs:
+            found |= run[np.searchsorted(run, ids).clip(max=run.size - 1)] == ids
+
+        mask = np.empty(ids.size, np.bool_)
+        mask[order] = found
+        return mask
+
+    def add(self, ids: np.ndarray):
+        """Adds IDs, which aren't present in set yet.
+
+        Parameters:
+            ids : numpy.ndarray
+                Unique IDs not present in set.
+        """
+        if not ids.size:
+            return
+
+        run = np.sort(ids)
+        while self.__runs and self.__runs[-1].size <= 2 * run.size:
+            # Concatenation of two sorted runs is sorted by merging them (stable sort finds runs)
+            run = np.sort(np.concatenate([self.__runs.pop(), run]), kind='stable')
+        self.__runs.append(run)
+
+
+def _update_dict_cache(downloader: DataDownloader, regions: list):
+    """Parses data for regions and saves them to cache. Used as task for worker processes in get_dict method.
+
+    Parameters:
+        downloader : DataDownloader
+            Instance used for parsing and caching.
+        regions : list of str
+            Region tags.
+
+    Returns:
+        tuple of (dict of (str, dict of numpy.ndarray), dict)
+            Region tag : dictionary with data for the region, metrics collected by worker (see Metrics.snapshot).
+    """
+    return downloader.update_dict_cache(regions), downloader.metrics.snapshot()
+
+
 if __name__ == '__main__':
-    DD = DataDownloader()
+    from metrics import print_progress
+
+    DD = DataDownloader(metrics=Metrics([print_progress]))
     d = DD.get_dict(['JHC', 'PLK', 'ULK'])
 
     print('DataSet info:')
@@ -318,3 +1382,6 @@ if __name__ == '__main__':
     for region_name in np.unique(d['region']):
         print(region_name.decode('UTF-8') + ' ', end='')
     print()
+
+    print('\nRun report:')
+    print(DD.metrics.format_report())
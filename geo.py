@@ -1,159 +1,462 @@
 #!/usr/bin/python3.8
 # coding=utf-8
 
-import os
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import sys
 import pandas as pd
 import geopandas
 import matplotlib.pyplot as plt
-import contextily as ctx
+import matplotlib.patches
+from matplotlib.colors import LogNorm
 import numpy as np
+import pyproj
 import sklearn.cluster
 import sklearn.mixture
+from report import save_figure
+from tiles import TileCache
 
+# Cache of basemap tiles, can be replaced e.g. with TileCache(folder=..., offline=True) for rendering without network
+tile_cache = TileCache()
 
-def make_geo(df: pd.DataFrame) -> geopandas.GeoDataFrame:
+# Default cache of grids made by grid_geo function, '(region, year, road class, cell, bounds, digest) : (grid, extent)',
+# holds at most grid_cache_size recently used grids
+grid_cache = collections.OrderedDict()
+grid_cache_size = 64
+
+
+@functools.lru_cache(maxsize=None)
+def _transformer(source: str, target: str) -> pyproj.Transformer:
+    """
+    Creates transformer between coordinate systems once for each pair.
+
+    Parameters:
+        source : str
+            Source CRS.
+        target : str
+            Target CRS.
+
+    Returns:
+        pyproj.Transformer
+            Transformer with (x, y) axis order.
+    """
+
+    return pyproj.Transformer.from_crs(source, target, always_xy=True)
+
+
+def make_geo(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Converts pandas.DataFrarme into pandas.GeoDataFrame with correct EPSG coding.
+    Adds coordinates projected to "EPSG:3857" (web mercator used by basemaps) to data frame as columns x and y.
 
-    Rows in data frame with invalid coordinates (np.nan) are deleted. CRS is set to "EPSG:5514".
+    Rows with invalid coordinates (np.nan) are removed first. Coordinates d and e ("EPSG:5514") are transformed once
+    for all the rows as arrays, no geometry objects are created, see to_geodataframe function.
 
     Parameters:
         df : pd.DataFrame
-            Data frame to be converted.
+            Data frame with columns d and e.
 
     Returns:
-        geopandas.GeoDataFrame
-            Converted data frame.
+        pd.DataFrame
+            Data frame with valid coordinates and columns x and y.
     """
 
-    gdf = geopandas.GeoDataFrame(df, geometry=geopandas.points_from_xy(df["d"], df["e"]), crs="EPSG:5514")
+    d = df["d"].to_numpy(np.float64)
+    e = df["e"].to_numpy(np.float64)
 
     # Drop rows with non-valid values
-    gdf.drop(gdf[np.isnan(gdf.d) | np.isnan(gdf.e)].index, inplace=True)
+    valid = np.isfinite(d) & np.isfinite(e)
+    df = df[valid].copy()
+
+    df["x"], df["y"] = _transformer("EPSG:5514", "EPSG:3857").transform(d[valid], e[valid])
+
+    return df
+
+
+def to_geodataframe(df: pd.DataFrame) -> geopandas.GeoDataFrame:
+    """
+    Creates geopandas.GeoDataFrame with point geometry from projected coordinates (x, y) made by make_geo function.
+
+    Parameters:
+        df : pd.DataFrame
+            Data frame made by make_geo function.
+
+    Returns:
+        geopandas.GeoDataFrame
+            Data frame with geometry, CRS is "EPSG:3857".
+    """
 
-    return gdf
+    return geopandas.GeoDataFrame(df, geometry=geopandas.points_from_xy(df["x"], df["y"]), crs="EPSG:3857")
 
 
-def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None, show_figure: bool = False):
+def group_geo(gdf: pd.DataFrame) -> dict:
     """
-    Plot 6 maps visualizing accidents position for years 2018-2020 both for highways and first class roads for VYS
-    region.
+    Groups projected coordinates by region, year (of p2a) and road class (p36), data frame is sorted only once and
+    each group is slice of sorted coordinates.
+
+    Rows without date or road class are left out.
+
+    Parameters:
+        gdf : pd.DataFrame
+            Data with projected coordinates, made by make_geo function.
+
+    Returns:
+        dict of (tuple, tuple of numpy.ndarray)
+            (region, year, road class) : (x, y) of group.
+    """
+
+    years = pd.to_datetime(gdf["p2a"]).dt.year.to_numpy(np.float64)
+    roads = gdf["p36"].to_numpy(np.float64, na_value=np.nan)
+    valid = ~np.isnan(years) & ~np.isnan(roads)
+
+    regions, region_codes = np.unique(gdf["region"].to_numpy().astype(str)[valid], return_inverse=True)
+    years = years[valid].astype(np.int64)
+    roads = roads[valid].astype(np.int64)
+
+    order = np.lexsort((roads, years, region_codes))
+    keys = [region_codes[order], years[order], roads[order]]
+    x = gdf["x"].to_numpy()[valid][order]
+    y = gdf["y"].to_numpy()[valid][order]
+
+    groups = {}
+    if not x.size:
+        return groups
+
+    # Groups start where any key changes
+    changes = np.zeros(x.size - 1, np.bool_)
+    for key in keys:
+        changes |= key[1:] != key[:-1]
+    bounds = np.concatenate([[0], np.flatnonzero(changes) + 1, [x.size]])
+
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        groups[(regions[keys[0][start]], int(keys[1][start]), int(keys[2][start]))] = (x[start:stop], y[start:stop])
+
+    return groups
+
+
+def density_grid(x: np.ndarray, y: np.ndarray, bounds: tuple, cell: float = 500, weights: np.ndarray = None):
+    """
+    Counts points in square cells of grid.
 
     Parameters:
-        gdf : pd.geoDataFrame
-            Data.
+        x, y : np.ndarray
+            Projected coordinates of points.
+        bounds : tuple of float
+            Area covered by grid as (xmin, ymin, xmax, ymax), it's extended to whole cells.
+        cell : float
+            Size of cell in meters.
+        weights : np.ndarray
+            Weight of each point, if None, each point has weight 1.
+
+    Returns:
+        tuple of (np.ndarray, tuple of float)
+            Grid (rows from south to north) and its extent as (left, right, bottom, top).
+    """
+
+    xmin, ymin, xmax, ymax = bounds
+    bins = (max(int(np.ceil((xmax - xmin) / cell)), 1), max(int(np.ceil((ymax - ymin) / cell)), 1))
+    extent = (xmin, xmin + bins[0] * cell, ymin, ymin + bins[1] * cell)
+
+    grid = np.histogram2d(x, y, bins, [extent[:2], extent[2:]], weights=weights)[0]
+
+    return grid.T, extent
+
+
+def grid_geo(groups: dict, region: str, year: int, p36: int, cell: float = 500, grids: dict = None):
+    """
+    Makes count grid of group of accidents (see density_grid function). Grid covers all the groups of region, so grids
+    of the region have same extent.
+
+    Parameters:
+        groups : dict
+            Coordinates grouped by group_geo function.
+        region : str
+            Region tag.
+        year : int
+            Year.
+        p36 : int
+            Road class.
+        cell : float
+            Size of cell in meters.
+        grids : dict
+            Cache of grids as '(region, year, road class, cell, bounds, digest) : (grid, extent)', where bounds are
+            covered area and digest is hash of coordinates of group, so grid of changed data isn't taken from cache.
+            Missing grid is added to it. If None, module grid_cache is used, which keeps grid_cache_size recently used
+            grids.
+
+    Returns:
+        tuple of (np.ndarray, tuple of float)
+            Grid and its extent, see density_grid function.
+    """
+
+    region_groups = [(x, y) for (group_region, _, _), (x, y) in groups.items() if group_region == region and x.size]
+    if region_groups:
+        bounds = (min(x.min() for x, _ in region_groups), min(y.min() for _, y in region_groups),
+                  max(x.max() for x, _ in region_groups), max(y.max() for _, y in region_groups))
+    else:
+        bounds = (0, 0, cell, cell)
+
+    x, y = groups.get((region, year, p36), (np.array([]), np.array([])))
+
+    # Hashing is several times faster than binning, so cached grid is found for any equal data
+    digest = hashlib.blake2b(np.ascontiguousarray(x, np.float64), digest_size=16)
+    digest.update(np.ascontiguousarray(y, np.float64))
+    key = (region, year, p36, cell, bounds, digest.hexdigest())
+
+    cache = grid_cache if grids is None else grids
+    if key in cache:
+        if grids is None:
+            grid_cache.move_to_end(key)
+        return cache[key]
+
+    result = density_grid(x, y, bounds, cell)
+    result = (result[0].astype(np.uint32), result[1])
+
+    cache[key] = result
+    while grids is None and len(grid_cache) > grid_cache_size:
+        grid_cache.popitem(last=False)
+
+    return result
+
+
+def plot_geo(gdf: pd.DataFrame, fig_location: str = None, show_figure: bool = False, regions: list = None,
+             years: list = None, groups: dict = None, mode: str = "scatter", cell: float = 500, grids: dict = None):
+    """
+    Plot maps visualizing accidents position both for highways and first class roads, one row of maps for each region
+    and year.
+
+    Accidents are drawn as points (mode "scatter"), or as one image of accidents counts in grid cells (mode
+    "density"), which takes same time for any number of accidents.
+
+    Parameters:
+        gdf : pd.DataFrame
+            Data with projected coordinates, made by make_geo function. Not used if groups are provided.
         fig_location : str
             Path to save the figure, if None, figure is not saved.
         show_figure : bool
             If true, figure window is shown.
+        regions : list of str
+            Region tags, if None, only VYS region is plotted.
+        years : list of int
+            Years, if None, years 2018-2020 are plotted.
+        groups : dict
+            Coordinates grouped by group_geo function, so more figures can be plotted with single grouping. If None,
+            gdf is grouped.
+        mode : str
+            "scatter" or "density".
+        cell : float
+            Size of grid cell in meters, used in mode "density".
+        grids : dict
+            Cache of grids used in mode "density", see grid_geo function. If None, module grid_cache is used, so
+            repeated figures of the same data (e.g. by report module) don't bin coordinates again.
     """
 
-    gdf = gdf[gdf["region"] == "VYS"]
-    # Turn off warning for chained assignment
-    pd.options.mode.chained_assignment = None
-    gdf["p2a"] = pd.to_datetime(gdf["p2a"])
-    gdf = gdf.to_crs("EPSG:3857")
-
-    fig, axs = plt.subplots(3, 2, figsize=(9, 7))
-    axs = axs.flatten()
-
-    dt2018 = pd.to_datetime("2018-01-01 00:00:00")
-    dt2019 = pd.to_datetime("2019-01-01 00:00:00")
-    dt2020 = pd.to_datetime("2020-01-01 00:00:00")
-    dt2021 = pd.to_datetime("2021-01-01 00:00:00")
-
-    # Plot accidents into map
-    gdf[(gdf["p36"] == 0) & (gdf["p2a"] >= dt2018) & (gdf["p2a"] < dt2019)].plot(
-        ax=axs[0], markersize=1, color="tab:green", label="nehody VYS kraj: dialnice (2018)", alpha=0.5)
-    gdf[(gdf["p36"] == 1) & (gdf["p2a"] >= dt2018) & (gdf["p2a"] < dt2019)].plot(
-        ax=axs[1], markersize=1, color="tab:red", label="nehody VYS kraj: cesty prvej triedy (2018)", alpha=0.5)
-    gdf[(gdf["p36"] == 0) & (gdf["p2a"] >= dt2019) & (gdf["p2a"] < dt2020)].plot(
-        ax=axs[2], markersize=1, color="tab:green", label="nehody VYS kraj: dialnice (2019)", alpha=0.5)
-    gdf[(gdf["p36"] == 1) & (gdf["p2a"] >= dt2019) & (gdf["p2a"] < dt2020)].plot(
-        ax=axs[3], markersize=1, color="tab:red", label="nehody VYS kraj: cesty prvej triedy (2019)", alpha=0.5)
-    gdf[(gdf["p36"] == 0) & (gdf["p2a"] >= dt2020) & (gdf["p2a"] < dt2021)].plot(
-        ax=axs[4], markersize=1, color="tab:green", label="nehody VYS kraj: dialnice (2020)", alpha=0.5)
-    gdf[(gdf["p36"] == 1) & (gdf["p2a"] >= dt2020) & (gdf["p2a"] < dt2021)].plot(
-        ax=axs[5], markersize=1, color="tab:red", label="nehody VYS kraj: cesty prvej triedy (2020)", alpha=0.5)
-
-    # Set basemap and styling
-    for ax in axs:
-        ctx.add_basemap(ax, crs=gdf.crs.to_string(), source=ctx.providers.CartoDB.Voyager)
-        ax.axis("off")
-        ax.legend(loc="upper right", fontsize=8)
+    if mode not in ["scatter", "density"]:
+        print('Invalid plot mode', file=sys.stderr)
+        exit(-1)
+
+    if groups is None:
+        groups = group_geo(gdf)
+
+    rows = [(region, year) for region in regions or ["VYS"] for year in years or [2018, 2019, 2020]]
+
+    fig, axs = plt.subplots(len(rows), 2, figsize=(9, 7 / 3 * len(rows)), squeeze=False)
+
+    # Color, color map and label of road classes (p36)
+    roads = {0: ("tab:green", "Greens", "dialnice"), 1: ("tab:red", "Reds", "cesty prvej triedy")}
+    empty = (np.array([]), np.array([]))
+
+    # Plot accidents into map, rows are regions and years, columns road classes
+    for (region, year), row_axs in zip(rows, axs):
+        for ax, p36 in zip(row_axs, roads):
+            color, cmap, road = roads[p36]
+            label = f"nehody {region} kraj: {road} ({year})"
+            x, y = groups.get((region, year, p36), empty)
+
+            if mode == "scatter":
+                ax.scatter(x, y, s=1, color=color, label=label, alpha=0.5)
+                ax.legend(loc="upper right", fontsize=8)
+            else:
+                grid, extent = grid_geo(groups, region, year, p36, cell, grids)
+                if grid.any():
+                    ax.imshow(np.ma.masked_equal(grid, 0), extent=extent, origin="lower", cmap=cmap, norm=LogNorm(),
+                              interpolation="nearest", zorder=1)
+                ax.set_xlim(extent[:2])
+                ax.set_ylim(extent[2:])
+                ax.legend(handles=[matplotlib.patches.Patch(color=color, label=label)], loc="upper right",
+                          fontsize=8)
+
+            # Set basemap and styling
+            ax.set_aspect("equal")
+            if x.size:
+                tile_cache.add_basemap(ax)
+            ax.axis("off")
 
     plt.tight_layout()
 
-    if fig_location:
-        path = ''
-        folders = fig_location.split(os.path.sep)[:-1]
+    save_figure(fig, fig_location, show_figure)
+
 
-        for folder in folders:
-            if not os.path.isdir(path := os.path.join(path, folder)):
-                os.mkdir(path)
+def _cluster_coords(coords: np.ndarray, method: str, params: dict) -> np.ndarray:
+    """
+    Clusters coordinates of one region. Used as task for worker processes in cluster_geo function.
 
-        plt.savefig(fig_location)
+    Parameters:
+        coords : np.ndarray
+            Coordinates (x, y) with shape (n, 2).
+        method : str
+            "dbscan" or "kmeans", see cluster_geo function.
+        params : dict
+            Parameters of clustering model.
 
-    if show_figure:
-        plt.show()
+    Returns:
+        np.ndarray
+            Cluster label of each point, -1 for noise.
+    """
 
-    plt.close(fig)
+    if not len(coords):
+        return np.array([], np.int32)
 
+    if method == "kmeans":
+        # Skúšal som iba toto, vyšlo mi to na prvý pokus celkom správne, aj algoritmus ale aj počet clusterov 25 je
+        # jediný čo som skúsil, vychádzalo mi to viac-menej pekne keď som si na druhý graf na porovnanie dal zobraziť
+        # nehody vo VYS na c. 1. triedy všetky v datasete a nastavil si nízku alphu 0.1 tak som to porovnával okom a
+        # prišlo mi že to zhlukovanie sa mi spravilo pekne, zhluky s nižšou farbou boli v porovnávanom grafe alfou skoro
+        # úplne prázdne, ešte som si to potom skúsil pustiť pre JHM a porovnal so vzorovým grafom zo zadania a celkom sa
+        # podobali až na pár menších rozdielov
+        model = sklearn.cluster.MiniBatchKMeans(n_clusters=min(params.get("n_clusters", 25), len(coords)))
+    else:
+        # Neighborhoods are found by KD-tree, so points are never compared with all the other points
+        model = sklearn.cluster.DBSCAN(eps=params.get("eps", 300), min_samples=params.get("min_samples", 10),
+                                       algorithm="kd_tree")
 
-def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None, show_figure: bool = False):
+    return model.fit(coords).labels_.astype(np.int32)
+
+
+def cluster_geo(gdf: pd.DataFrame, method: str = "dbscan", workers: int = None, **params) -> pd.Series:
     """
-    Plot map visualizing accidents positions for first class roads for VYS region grouping them into clusters.
+    Clusters accidents positions of each region separately, regions are clustered in parallel.
+
+    Methods:
+        "dbscan", density based clustering (DBSCAN) with KD-tree index over projected coordinates, finds hotspots of
+            any count and shape, points outside of dense areas are noise. Parameters: eps, radius of neighborhood in
+            meters (default 300), min_samples, points in neighborhood of core point (default 10),
+        "kmeans", MiniBatchKMeans, every point is in one of n_clusters clusters (default 25).
 
     Parameters:
-        gdf : pd.geoDataFrame
-            Data.
+        gdf : pd.DataFrame
+            Data with projected coordinates, made by make_geo function.
+        method : str
+            Clustering method, "dbscan" or "kmeans".
+        workers : int
+            Number of worker processes, if None, number of CPU cores is used. If 1, regions are clustered in main
+            process.
+        params
+            Parameters of method.
+
+    Returns:
+        pd.Series
+            Cluster label of each row (same index as gdf), labels are unique across regions, -1 for noise.
+    """
+
+    if method not in ["dbscan", "kmeans"]:
+        print('Invalid clustering method', file=sys.stderr)
+        exit(-1)
+
+    regions = gdf["region"].to_numpy().astype(str)
+    coords = gdf[["x", "y"]].to_numpy(np.float64)
+    names = np.unique(regions)
+    masks = [regions == name for name in names]
+
+    tasks = [coords[mask] for mask in masks]
+    if workers == 1 or len(tasks) < 2:
+        results = [_cluster_coords(task, method, params) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_cluster_coords, tasks, [method] * len(tasks), [params] * len(tasks)))
+
+    # Labels of each region are shifted after labels of previous regions
+    labels = np.full(len(gdf), -1, np.int32)
+    offset = 0
+    for mask, result in zip(masks, results):
+        labels[mask] = np.where(result >= 0, result + offset, -1)
+        offset += int(result.max()) + 1 if result.size else 0
+
+    return pd.Series(labels, index=gdf.index, name="cluster")
+
+
+def plot_cluster(gdf: pd.DataFrame, fig_location: str = None, show_figure: bool = False,
+                 region: str = "VYS", method: str = "kmeans", mode: str = "scatter", cell: float = 500,
+                 workers: int = None, **params):
+    """
+    Plot map visualizing accidents positions for first class roads for region grouping them into clusters. Points are
+    colored by count of accidents in their cluster, noise points (DBSCAN) are gray. In mode "density", grid cells are
+    colored by mean count of accidents in clusters of their points and noise is not drawn.
+
+    Parameters:
+        gdf : pd.DataFrame
+            Data with projected coordinates, made by make_geo function. If it contains column cluster (see
+            cluster_geo function), clusters are not computed again.
         fig_location : str
             Path to save the figure, if None, figure is not saved.
         show_figure : bool
             If true, figure window is shown.
+        region : str
+            Region tag, if None, all the regions are plotted.
+        method : str
+            Clustering method, see cluster_geo function.
+        mode : str
+            "scatter" or "density", see plot_geo function.
+        cell : float
+            Size of grid cell in meters, used in mode "density".
+        workers : int
+            Number of worker processes clustering regions, see cluster_geo function. Should be 1 if called from worker
+            process (e.g. by report module), so each worker doesn't start pool of its own.
+        params
+            Parameters of clustering method, see cluster_geo function.
     """
 
-    gdf = gdf[(gdf["region"] == "VYS") & (gdf["p36"] == 1)]
-    gdf = gdf.to_crs("EPSG:3857")
+    if mode not in ["scatter", "density"]:
+        print('Invalid plot mode', file=sys.stderr)
+        exit(-1)
+
+    mask = gdf["p36"].to_numpy(np.float64, na_value=np.nan) == 1
+    if region:
+        mask &= (gdf["region"] == region).to_numpy(np.bool_, na_value=False)
+    gdf = gdf[mask]
+
+    labels = (gdf["cluster"] if "cluster" in gdf.columns else cluster_geo(gdf, method, workers, **params)).to_numpy()
 
-    coords = np.dstack([gdf.geometry.x, gdf.geometry.y]).reshape(-1, 2)
-    # Skúšal som iba toto, vyšlo mi to na prvý pokus celkom správne, aj algoritmus ale aj počet clusterov 25 je jediný
-    # čo som skúsil, vychádzalo mi to viac-menej pekne keď som si na druhý graf na porovnanie dal zobraziť nehody vo VYS
-    # na c. 1. triedy všetky v datasete a nastavil si nízku alphu 0.1 tak som to porovnával okom a prišlo mi že to
-    # zhlukovanie sa mi spravilo pekne, zhluky s nižšou farbou boli v porovnávanom grafe alfou skoro úplne prázdne,
-    # ešte som si to potom skúsil pustiť pre JHM a porovnal so vzorovým grafom zo zadania a celkom sa podobali až na pár
-    # menších rozdielov
-    model = sklearn.cluster.MiniBatchKMeans(n_clusters=25)
-    db = model.fit(coords)
-    gdf["cluster"] = db.labels_
-    gdf["cnt"] = gdf.groupby("cluster")["cluster"].transform("count")
+    # Count of accidents in cluster of each point
+    clustered = labels >= 0
+    counts = np.bincount(labels[clustered])[labels[clustered]] if clustered.any() else np.array([], np.int64)
 
     fig, ax = plt.subplots(figsize=(8, 7))
 
-    gdf.plot(ax=ax, column="cnt", legend=True, markersize=2)
-    ctx.add_basemap(ax, crs=gdf.crs.to_string(), source=ctx.providers.CartoDB.Voyager)
+    if mode == "density":
+        x, y = gdf["x"].to_numpy()[clustered], gdf["y"].to_numpy()[clustered]
+        bounds = (x.min(), y.min(), x.max(), y.max()) if x.size else (0, 0, cell, cell)
+        points, extent = density_grid(x, y, bounds, cell)
+        sums = density_grid(x, y, bounds, cell, counts)[0]
+        with np.errstate(invalid="ignore"):
+            image = ax.imshow(np.ma.masked_where(points == 0, sums / points), extent=extent, origin="lower",
+                              interpolation="nearest", zorder=1)
+    else:
+        ax.scatter(gdf["x"][~clustered], gdf["y"][~clustered], color="lightgray", s=1)
+        image = ax.scatter(gdf["x"][clustered], gdf["y"][clustered], c=counts, s=2)
+    fig.colorbar(image, ax=ax)
+    ax.set_aspect("equal")
+    tile_cache.add_basemap(ax)
     ax.axis("off")
 
     plt.tight_layout()
 
-    if fig_location:
-        path = ''
-        folders = fig_location.split(os.path.sep)[:-1]
-
-        for folder in folders:
-            if not os.path.isdir(path := os.path.join(path, folder)):
-                os.mkdir(path)
-
-        plt.savefig(fig_location)
-
-    if show_figure:
-        plt.show()
-
-    plt.close(fig)
+    save_figure(fig, fig_location, show_figure)
 
 
 if __name__ == "__main__":
-    print("reading pickle and creating GeoDataFrame...")
+    print("reading pickle and projecting coordinates...")
     gdf = make_geo(pd.read_pickle("accidents.pkl.gz"))
 
     print("plot_geo...")
@@ -161,3 +464,6 @@ if __name__ == "__main__":
 
     print("plot_cluster...")
     plot_cluster(gdf, "cluster.png", True)
+
+    print("plot_cluster (hotspots)...")
+    plot_cluster(gdf, "hotspots.png", True, region=None, method="dbscan")
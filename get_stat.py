@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-"""Script containing single function that makes 2 plots visualizing accident count in regions based on column about
-driving priority changes on road (p24). Plots:
+"""Script containing function that makes 2 plots visualizing accident count in regions based on column about
+driving priority changes on road (p24) and crosstab function counting rows for each pair of values of two columns,
+which can be used by other reports. Plots:
     1. linear, logarithmic,
     2. relative, percentage.
 
@@ -11,13 +12,94 @@ If run as main script, takes two optional arguments:
     --fig_location, path where to save file, default=None,
     --show-figure, tells if show figure in separate window, default=False.
 
-Out of non-built-in libraries this script uses matplotlib.pyplot, matplotlib.colors.LogNorm, numpy
+Out of non-built-in libraries this script uses matplotlib.pyplot, matplotlib.colors.LogNorm, numpy, pandas
 """
 
-import os
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.colors import LogNorm
+from download import DataDownloader
+from report import save_figure
+
+
+def _label_codes(values, labels=None):
+    """Assigns each value index of its label.
+
+    Parameters:
+        values : numpy.ndarray or pandas.Categorical
+            Values of column.
+        labels : array like, optional, default: None
+            Labels, if None, sorted unique values are used.
+
+    Returns:
+        tuple of (numpy.ndarray, numpy.ndarray)
+            Index of label for each value (-1 if value has no label), labels.
+    """
+    if isinstance(values, pd.Categorical):
+        # Only categories are labeled, codes are translated by lookup table
+        table, labels = _label_codes(np.asarray(values.categories), labels)
+        return np.append(table, -1)[values.codes], labels
+
+    values = np.asarray(values)
+
+    if labels is None:
+        labels, codes = np.unique(values, return_inverse=True)
+        return codes, labels
+
+    labels = np.asarray(labels)
+    if values.dtype.kind == "S" and labels.dtype.kind == "U":
+        labels = np.char.encode(labels)
+
+    if not labels.size:
+        return np.full(values.shape, -1, np.intp), labels
+
+    order = np.argsort(labels, kind="stable")
+    positions = np.searchsorted(labels[order], values).clip(max=labels.size - 1)
+    codes = np.where(labels[order][positions] == values, order[positions], -1)
+
+    return codes, labels
+
+
+def crosstab(data: dict, row_col: str, col_col: str, rows=None, cols=None, weights: str = None):
+    """Counts rows of data for each pair of values of two columns in single pass, by counting combined key of both
+    columns with numpy.bincount.
+
+    Parameters:
+        data : dict of numpy.ndarray
+            Data made using DataDownloader class (values can be numpy.ndarray or pandas.Categorical).
+        row_col : str
+            Column, which values are rows of result.
+        col_col : str
+            Column, which values are columns of result.
+        rows : array like, optional, default: None
+            Values of row_col in order of result rows, other values are not counted. If None, sorted unique values of
+            row_col are used.
+        cols : array like, optional, default: None
+            Values of col_col in order of result columns, other values are not counted. If None, sorted unique values
+            of col_col are used.
+        weights : str, optional, default: None
+            Column with weight of each row, e.g. "count" of aggregated data (see cube.ReportCube). If None, each row
+            has weight 1.
+
+    Returns:
+        tuple of (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+            Matrix of counts with shape (rows, cols), values of rows, values of columns.
+    """
+    row_codes, rows = _label_codes(data[row_col], rows)
+    col_codes, cols = _label_codes(data[col_col], cols)
+
+    key = row_codes * len(cols) + col_codes
+    valid = (row_codes >= 0) & (col_codes >= 0)
+
+    if weights is None:
+        counts = np.bincount(key[valid], minlength=len(rows) * len(cols))
+    else:
+        counts = np.bincount(key[valid], data[weights][valid], len(rows) * len(cols)).astype(np.int64)
+
+    counts = counts.reshape(len(rows), len(cols))
+
+    return counts, rows, cols
 
 
 def plot_stat(data_source: dict, fig_location: str = None, show_figure: bool = False):
@@ -28,7 +110,8 @@ def plot_stat(data_source: dict, fig_location: str = None, show_figure: bool = F
 
     Parameters:
         data_source : dict of numpy.ndarray
-            Data from police department sites made using DataDownloader class.
+            Data from police department sites made using DataDownloader class, or aggregated data with column
+            "count" made using ReportCube class.
         fig_location : str
             Path like parameter. In addition to file name, can contain folders, subfolder, or represent absolute path.
             If some of folder in paths does not exists, it's created.
@@ -45,21 +128,12 @@ def plot_stat(data_source: dict, fig_location: str = None, show_figure: bool = F
     x_labels = list(DataDownloader.regions.keys())
 
     # Data matrices for both graphs
-    data1 = np.zeros((len(y_labels), len(x_labels)), np.uint)    # Absolute graph
-    data2 = np.empty((len(y_labels), len(x_labels)), np.single)  # Relative graph
-
-    # Calculate linear values for absolute graph
-    for i in range(len(y_labels)):
-        for j in range(len(x_labels)):
-            data1[i, j] = np.count_nonzero(np.logical_and(
-                data_source["p24"] == i,
-                data_source["region"] == x_labels[j].encode()
-            ))
-
-    # Calculate percentage values for relative graph
-    for i in range(len(y_labels)):
-        for j in range(len(x_labels)):
-            data2[i, j] = data1[i, j] / np.sum(data_source["p24"] == i) * 100
+    data1 = crosstab(data_source, "p24", "region", np.arange(len(y_labels)), x_labels,
+                     "count" if "count" in data_source else None)[0]  # Absolute graph
+
+    # Relative graph, percentage of row sums
+    with np.errstate(divide="ignore", invalid="ignore"):
+        data2 = (data1 / data1.sum(axis=1, keepdims=True) * 100).astype(np.single)
 
     # Create masked arrays (to mask zero data spots to white color)
     data1_masked = np.ma.masked_where(data1 == 0, data1)
@@ -69,7 +143,8 @@ def plot_stat(data_source: dict, fig_location: str = None, show_figure: bool = F
 
     fig, (ax1, ax2) = plt.subplots(2)
 
-    im1 = ax1.imshow(data1_masked, norm=LogNorm())
+    # Logarithmic scale can't be made without any nonzero value (e.g. for year without data)
+    im1 = ax1.imshow(data1_masked, norm=LogNorm() if data1.any() else None)
     im2 = ax2.imshow(data2_masked)
 
     ax1.set_xticks(np.arange(len(x_labels)))
@@ -97,25 +172,12 @@ def plot_stat(data_source: dict, fig_location: str = None, show_figure: bool = F
 
     fig.tight_layout()
 
-    if fig_location:
-        path = ''
-        folders = fig_location.split(os.path.sep)[:-1]
-
-        for folder in folders:
-            if not os.path.isdir(path := os.path.join(path, folder)):
-                os.mkdir(path)
-
-        plt.savefig(fig_location)
-
-    if show_figure:
-        plt.show()
-
-    plt.close(fig)
+    save_figure(fig, fig_location, show_figure)
 
 
 if __name__ == '__main__':
     import argparse
-    from download import DataDownloader
+    from cube import ReportCube
 
     parser = argparse.ArgumentParser()
 
@@ -126,6 +188,9 @@ if __name__ == '__main__':
     fig_location = args.fig_location
     show_figure = args.show_figure
 
-    data_source = DataDownloader().get_dict()
+    # Counts are read from aggregated data, cube is updated with new files first
+    cube = ReportCube(DataDownloader())
+    cube.update()
+    data_source = cube.get(["p24", "region"])
 
     plot_stat(data_source, fig_location, show_figure)
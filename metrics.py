@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module containing one class Metrics for instrumentation of data processing (used by DataDownloader class), and
+callback print_progress printing progress of run to stdout.
+
+Metrics collects:
+    stages, number of calls, total time and optionally peak of allocated memory (tracemalloc) of named stages, stages
+        can be nested,
+    counters, e.g. downloaded bytes or cache hits, in total and for each region,
+    peak memory of process (resident set size),
+    optionally profile (cProfile) of outermost stages.
+Callbacks are notified about each stage start and end, counter change and other events (e.g. start of download), so
+progress can be shown or exported without changing instrumented code. Metrics of worker processes are collected by
+their own copy of instance and merged by merge method.
+
+Out of non-built-in libraries this module uses none
+"""
+
+import contextlib
+import cProfile
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory of process is not reported there
+    resource = None
+
+
+class Metrics:
+    """Class for collecting stage timings, counters and memory of run
+
+    Attributes
+        callbacks : list of callable [Instance Attribute]
+            Functions called as 'callback(kind, name, info)' for each event, kind is "start" or "end" (of stage),
+            "count" (of counter) or name of other event, info is dictionary with details of event.
+        trace_memory : bool [Instance Attribute]
+            If true, peak of allocated memory of each stage is traced by tracemalloc.
+        profile : bool [Instance Attribute]
+            If true, outermost stages are profiled by cProfile.
+        __stages : dict of (str, dict) [Instance Attribute]
+            Stage name : dictionary with 'calls', 'time' and 'peak'.
+        __counters : dict of (str, int) [Instance Attribute]
+            Counter name : value.
+        __regions : dict of (str, dict of (str, int)) [Instance Attribute]
+            Region tag : counter name : value.
+        __stack : list of list [Instance Attribute]
+            Running stages as [name, peak of memory of nested stages].
+        __peak_rss : int [Instance Attribute]
+            Peak memory of worker processes merged by merge method, in bytes.
+        __profiler : cProfile.Profile [Instance Attribute]
+            Profiler, None if profile is false.
+    """
+
+    def __init__(self, callbacks: list = None, trace_memory: bool = False, profile: bool = False):
+        """
+        Parameters:
+            callbacks : list of callable, optional, default: None
+                Functions called for each event, see callbacks attribute, e.g. print_progress function.
+            trace_memory : bool
+                If true, peak of allocated memory of each stage is traced by tracemalloc (slows down allocations).
+            profile : bool
+                If true, outermost stages are profiled by cProfile, see profile_stats method. Stages run by worker
+                processes are not profiled.
+        """
+        self.callbacks = list(callbacks or [])
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.__stages = {}
+        self.__counters = {}
+        self.__regions = {}
+        self.__stack = []
+        self.__peak_rss = 0
+        self.__profiler = cProfile.Profile() if profile else None
+        self.__lock = threading.Lock()
+
+    def __getstate__(self):
+        """Copy for worker process starts without collected values, callbacks and profiler."""
+        return {"callbacks": [], "trace_memory": self.trace_memory, "profile": False}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def event(self, kind: str, name: str = None, **info):
+        """Notifies callbacks about event.
+
+        Parameters:
+            kind : str
+                Kind of event, e.g. "download".
+            name : str, optional, default: None
+                Name of stage or counter, or subject of event.
+            info
+                Details of event.
+        """
+        for callback in self.callbacks:
+            callback(kind, name, info)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **info):
+        """Context manager measuring stage, time (and memory) of stage is added to stage statistics on exit.
+
+        Stages have to be entered from one thread, nested stages are counted in time of their outer stages too.
+
+        Parameters:
+            name : str
+                Stage name.
+            info
+                Details of stage passed to callbacks, e.g. region.
+        """
+        depth = len(self.__stack)
+        started = self.trace_memory and not tracemalloc.is_tracing()
+        tracing = self.trace_memory
+
+        if started:
+            tracemalloc.start()
+        if tracing:
+            # Peak reached so far belongs to outer stage, traced peak is reset for this stage
+            if self.__stack:
+                self.__stack[-1][1] = max(self.__stack[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if self.__profiler is not None and not depth:
+            self.__profiler.enable()
+
+        self.__stack.append([name, 0])
+        self.event("start", name, depth=depth, **info)
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = None
+
+            _, nested_peak = self.__stack.pop()
+            if tracing:
+                peak = max(nested_peak, tracemalloc.get_traced_memory()[1])
+                if self.__stack:
+                    self.__stack[-1][1] = max(self.__stack[-1][1], peak)
+            if started:
+                tracemalloc.stop()
+            if self.__profiler is not None and not depth:
+                self.__profiler.disable()
+
+            with self.__lock:
+                stage = self.__stages.setdefault(name, {"calls": 0, "time": 0.0, "peak": None})
+                stage["calls"] += 1
+                stage["time"] += elapsed
+                if peak is not None:
+                    stage["peak"] = max(stage["peak"] or 0, peak)
+
+            self.event("end", name, depth=depth, time=elapsed, peak=peak, **info)
+
+    def count(self, name: str, value: int = 1, region: str = None):
+        """Adds value to counter, can be called from any thread.
+
+        Parameters:
+            name : str
+                Counter name.
+            value : int
+                Added value.
+            region : str, optional, default: None
+                Region tag, if given, value is also added to counter of region.
+        """
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+            if region is not None:
+                region_counters = self.__regions.setdefault(region, {})
+                region_counters[name] = region_counters.get(name, 0) + value
+
+        self.event("count", name, value=value, region=region)
+
+    def snapshot(self):
+        """Collected values, which can be passed between processes and merged by merge method.
+
+        Returns:
+            dict
+                Collected values as 'stages', 'counters', 'regions' and 'peak_rss'.
+        """
+        with self.__lock:
+            return {
+                "stages": {name: dict(stage) for name, stage in self.__stages.items()},
+                "counters": dict(self.__counters),
+                "regions": {region: dict(counters) for region, counters in self.__regions.items()},
+                "peak_rss": max(self.__peak_rss, self.peak_rss() or 0),
+            }
+
+    def merge(self, snapshot: dict):
+        """Adds values collected by other instance (e.g. in worker process), see snapshot method.
+
+        Parameters:
+            snapshot : dict
+                Collected values of other instance.
+        """
+        with self.__lock:
+            for name, other in snapshot["stages"].items():
+                stage = self.__stages.setdefault(name, {"calls": 0, "time": 0.0, "peak": None})
+                stage["calls"] += other["calls"]
+                stage["time"] += other["time"]
+                if other["peak"] is not None:
+                    stage["peak"] = max(stage["peak"] or 0, other["peak"])
+
+            for name, value in snapshot["counters"].items():
+                self.__counters[name] = self.__counters.get(name, 0) + value
+
+            for region, counters in snapshot["regions"].items():
+                region_counters = self.__regions.setdefault(region, {})
+                for name, value in counters.items():
+                    region_counters[name] = region_counters.get(name, 0) + value
+
+            self.__peak_rss = max(self.__peak_rss, snapshot["peak_rss"])
+
+    @staticmethod
+    def peak_rss():
+        """Peak memory (resident set size) of current process.
+
+        Returns:
+            int
+                Peak memory in bytes, None if it can't be measured on this platform.
+        """
+        if resource is None:
+            return None
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def profile_stats(self):
+        """Statistics of profiled stages.
+
+        Returns:
+            pstats.Stats
+                Statistics, None if profile is false or nothing was profiled yet.
+        """
+        if self.__profiler is None:
+            return None
+
+        try:
+            return pstats.Stats(self.__profiler)
+        except TypeError:
+            # Profiler without any data
+            return None
+
+    def report(self, top: int = 20):
+        """Makes structured report of run.
+
+        Parameters:
+            top : int
+                Number of functions with the greatest cumulative time in profile.
+
+        Returns:
+            dict
+                Report with keys:
+                    stages, stage name : dictionary with 'calls', 'time' in seconds and 'peak' of allocated memory in
+                        bytes (None if memory isn't traced), times of stages run by parallel workers are summed,
+                    counters, counter name : value,
+                    regions, region tag : counter name : value,
+                    peak_rss, peak memory of process and its workers in bytes (worker processes are measured
+                        separately, the greatest value is reported),
+                    profile, list of functions with the greatest cumulative time as dictionaries with 'function',
+                        'calls', 'time' and 'cumulative' (only if profile is true).
+        """
+        report = self.snapshot()
+
+        if (stats := self.profile_stats()) is not None:
+            entries = sorted(stats.stats.items(), key=lambda entry: -entry[1][3])[:top]
+            report["profile"] = [{"function": f'{filename}:{line}({function})', "calls": calls, "time": total,
+                                  "cumulative": cumulative}
+                                 for (filename, line, function), (_, calls, total, cumulative, _) in entries]
+
+        return report
+
+    def format_report(self, top: int = 20):
+        """Formats report of run (see report method) as text table.
+
+        Parameters:
+            top : int
+                Number of functions with the greatest cumulative time in profile.
+
+        Returns:
+            str
+                Formatted report.
+        """
+        report = self.report(top)
+        lines = [f'{"stage":<24} {"calls":>7} {"time":>10} {"peak":>12}']
+
+        for name, stage in sorted(report["stages"].items(), key=lambda item: -item[1]["time"]):
+            peak = f'{stage["peak"] / 1_048_576:9.1f} MB' if stage["peak"] is not None else f'{"-":>12}'
+            lines.append(f'{name:<24} {stage["calls"]:>7} {stage["time"]:9.3f}s {peak}')
+
+        if report["counters"]:
+            lines.append('')
+            lines.extend(f'{name:<32} {value:>14}' for name, value in sorted(report["counters"].items()))
+
+        if report["regions"]:
+            names = sorted({name for counters in report["regions"].values() for name in counters})
+            lines.append('')
+            lines.append(f'{"region":<8}' + ''.join(f' {name:>18}' for name in names))
+            for region, counters in sorted(report["regions"].items()):
+                lines.append(f'{region:<8}' + ''.join(f' {counters.get(name, 0):>18}' for name in names))
+
+        if report["peak_rss"] is not None:
+            lines.append('')
+            lines.append(f'peak memory {report["peak_rss"] / 1_048_576:.1f} MB')
+
+        if report.get("profile"):
+            lines.append('')
+            lines.append(f'{"cumulative":>10} {"time":>10} {"calls":>9}  function')
+        for entry in report.get("profile", []):
+            lines.append(f'{entry["cumulative"]:9.3f}s {entry["time"]:9.3f}s {entry["calls"]:>9}  {entry["function"]}')
+
+        return '\n'.join(lines)
+
+
+def print_progress(kind: str, name: str, info: dict):
+    """Callback of Metrics printing downloads and finished outermost stages to stdout.
+
+    Parameters:
+        kind : str
+            Kind of event.
+        name : str
+            Name of stage or counter, or subject of event.
+        info : dict
+            Details of event.
+    """
+    if kind == "download":
+        print('Downloading "' + info["url"] + '"')
+    elif kind == "end" and not info["depth"]:
+        print(f'{name} done in {info["time"]:.2f} s')
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Script containing headless batch renderer of reports (get_stat, geo, doc modules) and helper for saving figures
+shared by these modules.
+
+Data are parsed (or updated) once in main process and cached on disk, figures are rendered by worker processes with
+Agg backend, which read memory mapped cache (see DataDownloader.load_dict_cache) or aggregated data (see ReportCube).
+Each figure is rendered for one (report, region, year) combination, reports split by:
+    stat, year (all the regions in one figure),
+    geo, region and year (years 2018-2020 in one figure without years),
+    cluster, region,
+    hotspots, year (all the regions in one figure),
+    doc, region and year (printed values are saved to text file next to figure).
+
+Can be imported as module, or run as main script.
+If run as main script, renders reports and prints per figure timing summary to stdout, takes optional arguments:
+    --reports, names of rendered reports, default=all the reports,
+    --regions, region tags, default=all the regions,
+    --years, years of reports split by year, default=whole data in one figure,
+    --folder, path to folder with data, default=data,
+    --target, path to folder for figures, default=reports,
+    --workers, number of worker processes, default=number of CPU cores,
+    --format, format of figures, default=png.
+
+Out of non-built-in libraries this script uses matplotlib (and libraries of rendered reports)
+"""
+
+import concurrent.futures
+import contextlib
+import io
+import os
+import sys
+import time
+import matplotlib
+import matplotlib.pyplot as plt
+
+
+def save_figure(fig, fig_location: str = None, show_figure: bool = False):
+    """Saves figure and/or shows it in separate window, figure is closed afterwards.
+
+    Parameters:
+        fig : matplotlib.figure.Figure
+            Figure.
+        fig_location : str
+            Path like parameter. In addition to file name, can contain folders, subfolder, or represent absolute path.
+            If some of folder in paths does not exists, it's created. If None, figure is not saved.
+        show_figure : bool
+            If true, figure is shown in separate window.
+    """
+    if fig_location:
+        if folder := os.path.dirname(fig_location):
+            os.makedirs(folder, exist_ok=True)
+
+        fig.savefig(fig_location)
+
+    if show_figure:
+        plt.show()
+
+    plt.close(fig)
+
+
+def _year_where(column: str, year: int):
+    """Makes condition for rows of one year, see DataDownloader.where_mask method.
+
+    Parameters:
+        column : str
+            Column with dates.
+        year : int
+            Year, if None, there is no condition.
+
+    Returns:
+        dict
+            Condition.
+    """
+    return {column: (f'{year}-01-01', f'{year + 1}-01-01')} if year else None
+
+
+# Render functions load data of one figure through downloader and render it to fig_location
+
+
+def _render_stat(downloader, region: str, year: int, fig_location: str):
+    """Renders get_stat.plot_stat from aggregated data of year."""
+    import get_stat
+    from cube import ReportCube
+
+    where = {"month": (f'{year}-01', f'{year + 1}-01')} if year else None
+    get_stat.plot_stat(ReportCube(downloader).get(["p24", "region"], where), fig_location)
+
+
+def _render_geo(downloader, region: str, year: int, fig_location: str):
+    """Renders geo.plot_geo for region and year (years 2018-2020 if year is None)."""
+    import analysis
+    import geo
+
+    df = analysis.load_dataframe(downloader, [region], ["p36", "p2a", "d", "e", "region"],
+                                 where=_year_where("p2a", year))
+    geo.plot_geo(geo.make_geo(df), fig_location, regions=[region], years=[year] if year else None)
+
+
+def _render_cluster(downloader, region: str, year: int, fig_location: str):
+    """Renders geo.plot_cluster for region."""
+    import analysis
+    import geo
+
+    df = analysis.load_dataframe(downloader, [region], ["p36", "d", "e", "region"])
+    geo.plot_cluster(geo.make_geo(df), fig_location, region=region, workers=1)
+
+
+def _render_hotspots(downloader, region: str, year: int, fig_location: str):
+    """Renders geo.plot_cluster with DBSCAN hotspots of all the regions for year."""
+    import analysis
+    import geo
+
+    df = analysis.load_dataframe(downloader, None, ["p36", "d", "e", "region"],
+                                 where={"p36": 1, **(_year_where("p2a", year) or {})})
+    # Figures are already rendered in parallel, so regions are clustered in this worker without pool of its own
+    geo.plot_cluster(geo.make_geo(df), fig_location, region=None, method="dbscan", workers=1)
+
+
+def _render_doc(downloader, region: str, year: int, fig_location: str):
+    """Renders doc.make_doc for region and year, printed values are saved to text file."""
+    import analysis
+    import doc
+
+    df = analysis.load_dataframe(downloader, [region], ["p9", "p12", "p13a"], where=_year_where("p2a", year))
+
+    # Text file is written only after whole document is made, so failed document doesn't leave part of it
+    text = io.StringIO()
+    with contextlib.redirect_stdout(text):
+        doc.make_doc(df, fig_location)
+    with open(os.path.splitext(fig_location)[0] + '.txt', 'w') as f:
+        f.write(text.getvalue())
+
+
+# Report name : (render function, split by region, split by year)
+REPORTS = {
+    "stat": (_render_stat, False, True),
+    "geo": (_render_geo, True, True),
+    "cluster": (_render_cluster, True, False),
+    "hotspots": (_render_hotspots, False, True),
+    "doc": (_render_doc, True, True),
+}
+
+# Downloader of worker process, see _init_worker
+_downloader = None
+
+
+def _init_worker(folder: str):
+    """Initializes worker process, sets Agg backend and creates downloader reading cached data.
+
+    Parameters:
+        folder : str
+            Path to folder with data.
+    """
+    global _downloader
+    from download import DataDownloader
+
+    matplotlib.use("Agg")
+    _downloader = DataDownloader(folder=folder, lazy=True)
+
+
+def _render(task: tuple):
+    """Renders one figure. Used as task for worker processes in run function.
+
+    Parameters:
+        task : tuple of (str, str, int, str)
+            Report name, region tag (None for all the regions), year (None for whole data), path of figure.
+
+    Returns:
+        tuple of (str, str, int, str, float)
+            Report name, region tag, year, path of figure, time of rendering in seconds.
+    """
+    report, region, year, fig_location = task
+
+    start = time.perf_counter()
+    REPORTS[report][0](_downloader, region, year, fig_location)
+
+    return report, region, year, fig_location, time.perf_counter() - start
+
+
+def run(reports: list = None, regions: list = None, years: list = None, folder: str = "data",
+        target: str = "reports", workers: int = None, fmt: str = "png"):
+    """Renders figures of reports for each needed (report, region, year) combination by pool of worker processes and
+    prints per figure timing summary to stdout. Figure, which fails, doesn't stop rendering of other figures, failed
+    figures are printed with their errors to stderr.
+
+    Parameters:
+        reports : list of str, optional, default: None
+            Names of rendered reports (keys of REPORTS). If None, all the reports are rendered.
+        regions : list of str, optional, default: None
+            Region tags for reports split by region. If None, all the regions are used.
+        years : list of int, optional, default: None
+            Years for reports split by year. If None, each report has one figure for whole data.
+        folder : str
+            Path to folder with data.
+        target : str
+            Path to folder, where figures are saved, created if doesn't exist.
+        workers : int, optional, default: None
+            Number of worker processes. If None, number of CPU cores is used.
+        fmt : str
+            Format (file extension) of figures.
+
+    Returns:
+        list of tuple of (str, str, int, str, float)
+            Report name, region tag, year, path of figure and time of rendering in seconds for each rendered figure.
+    """
+    from download import DataDownloader
+    from cube import ReportCube
+
+    matplotlib.use("Agg")
+
+    reports = reports or list(REPORTS.keys())
+    regions = regions or list(DataDownloader.regions.keys())
+
+    start = time.perf_counter()
+
+    # Data are parsed once, workers read only cache
+    downloader = DataDownloader(folder=folder, lazy=True)
+    if "stat" in reports:
+        ReportCube(downloader).update(workers)
+    else:
+        downloader.get_dict(workers=workers, columns=[DataDownloader.headers[0]])
+
+    print(f'data ready in {time.perf_counter() - start:.2f} s')
+
+    tasks = []
+    for report in reports:
+        for region in regions if REPORTS[report][1] else [None]:
+            for year in years or [None] if REPORTS[report][2] else [None]:
+                name = '_'.join(str(part) for part in [report, region, year] if part is not None)
+                tasks.append((report, region, year, os.path.join(target, name + '.' + fmt)))
+
+    start = time.perf_counter()
+    results, failed = [], []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(folder,)) as executor:
+        futures = {executor.submit(_render, task): task for task in tasks}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                failed.append((futures[future][3], e))
+    wall = time.perf_counter() - start
+
+    print(f'{"figure":<40} {"time":>8}')
+    for report, region, year, fig_location, seconds in sorted(results, key=lambda result: -result[4]):
+        print(f'{os.path.basename(fig_location):<40} {seconds:7.2f}s')
+    print(f'{len(results)} figures, render time {sum(result[4] for result in results):.2f} s, '
+          f'wall time {wall:.2f} s')
+
+    for fig_location, e in sorted(failed, key=lambda failure: failure[0]):
+        print(f'{os.path.basename(fig_location)} failed: {type(e).__name__}: {e}', file=sys.stderr)
+    if failed:
+        print(f'{len(failed)} figures failed', file=sys.stderr)
+
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--reports", nargs="+", choices=list(REPORTS.keys()))
+    parser.add_argument("--regions", nargs="+")
+    parser.add_argument("--years", nargs="+", type=int)
+    parser.add_argument("--folder", default="data")
+    parser.add_argument("--target", default="reports")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--format", default="png")
+
+    args = parser.parse_args()
+
+    run(args.reports, args.regions, args.years, args.folder, args.target, args.workers, args.format)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module containing typed schema of data from Czech republic police department website, shared by DataDownloader
+parser and cache (download.py) and pandas loader (analysis.py).
+
+Each column has:
+    name, CSV header (or 'region' for region tag added by parser),
+    dtype, smallest numpy data type holding all values of the column,
+    null, value used for empty or invalid values,
+    parser, way the column is converted from CSV strings:
+        "int", integer, empty or invalid values are replaced with null,
+        "float", decimal comma float, invalid values are replaced with null (nan),
+        "str", string, dictionary encoded as pandas.Categorical, dtype is data type of its codes,
+        "time", time in HHMM format, invalid values are replaced with null,
+        "date", date in YYYY-MM-DD format, invalid values are replaced with null (NaT),
+        "region", region tag, not part of CSV,
+    pandas, pandas data type of the column, integer columns have nullable data types (e.g. "UInt8"), so null values
+        are pandas.NA in data frames.
+
+Out of non-built-in libraries this module uses numpy and pandas
+"""
+
+import collections
+import numpy as np
+import pandas as pd
+
+Column = collections.namedtuple("Column", ["name", "dtype", "null", "parser", "pandas"])
+
+
+def _column(name: str, dtype, parser: str = "int", pandas: str = None):
+    """Creates column of schema with null value and pandas data type derived from numpy data type.
+
+    Parameters:
+        name : str
+            Column name.
+        dtype : numpy data type like
+            Numpy data type.
+        parser : str
+            Parser of the column.
+        pandas : str
+            Pandas data type, if None, it's derived from numpy data type.
+
+    Returns:
+        Column
+            Column of schema.
+    """
+    dtype = np.dtype(dtype)
+
+    if parser == "float":
+        null = np.nan
+    elif parser == "date":
+        null = np.datetime64("NaT")
+    elif parser in ["str", "region"]:
+        null = ""
+    elif dtype.kind == "u":
+        # Unsigned columns are never empty in CSV, invalid values are marked by maximal value
+        null = np.iinfo(dtype).max
+    else:
+        null = -1
+
+    if pandas is None:
+        if parser in ["str", "region"]:
+            pandas = "category"
+        elif parser == "date":
+            pandas = "datetime64[ns]"
+        elif dtype.kind in "iu":
+            pandas = ("UInt" if dtype.kind == "u" else "Int") + str(dtype.itemsize * 8)
+        else:
+            pandas = dtype.name
+
+    return Column(name, dtype, null, parser, pandas)
+
+
+COLUMNS = [
+    _column("p1", np.int64),
+    _column("p36", np.uint8),
+    _column("p37", np.int32),
+    _column("p2a", "datetime64[D]", "date"),
+    _column("weekday(p2a)", np.uint8),
+    _column("p2b", np.int16, "time"),
+    *[_column(name, np.uint8) for name in ["p6", "p7", "p8", "p9", "p10", "p11"]],
+    _column("p12", np.uint16),
+    *[_column(name, np.uint8) for name in ["p13a", "p13b", "p13c"]],
+    _column("p14", np.int32),
+    *[_column(name, np.uint8) for name in ["p15", "p16", "p17", "p18", "p19", "p20", "p21", "p22", "p23", "p24",
+                                           "p27", "p28", "p34", "p35"]],
+    _column("p39", np.int8),
+    _column("p44", np.uint8),
+    *[_column(name, np.int8) for name in ["p45a", "p47", "p48a", "p49", "p50a", "p50b", "p51", "p52"]],
+    _column("p53", np.int32),
+    *[_column(name, np.int8) for name in ["p55a", "p57", "p58"]],
+    *[_column(name, np.float32, "float") for name in ["a", "b", "d", "e", "f", "g"]],
+    *[_column(name, np.int32, "str") for name in ["h", "i", "j", "k", "l", "n", "o", "p", "q"]],
+    _column("r", np.int32, pandas="category"),
+    _column("s", np.int32, pandas="category"),
+    _column("t", np.int32, "str"),
+    _column("p5a", np.int8),
+    _column("region", "S3", "region"),
+]
+
+# Columns by name
+COLUMNS_BY_NAME = {column.name: column for column in COLUMNS}
+
+# CSV headers names, in order of CSV columns
+HEADERS = [column.name for column in COLUMNS if column.parser != "region"]
+
+
+def as_column(name: str, values):
+    """Converts values to representation of column in schema, pandas.Categorical for "str" columns, numpy.ndarray
+    with data type of column otherwise.
+
+    Parameters:
+        name : str
+            Column name.
+        values : array like
+            Converted values.
+
+    Returns:
+        numpy.ndarray or pandas.Categorical
+            Converted values.
+    """
+    column = COLUMNS_BY_NAME[name]
+
+    if column.parser != "str":
+        return np.asarray(values).astype(column.dtype, copy=False)
+    elif isinstance(values, pd.Categorical):
+        return values
+
+    values = np.asarray(values)
+    return pd.Categorical(values.astype(str) if values.dtype.kind == "S" else values)
+
+
+def as_numbers(name: str, values: pd.Series):
+    """Converts values of "int", "float" or "time" column to float numbers, as parser of the column does. Strings are
+    parsed (with decimal comma in "float" columns), empty and invalid values (and times not in HHMM format) are nan.
+    Null values of schema are kept.
+
+    Parameters:
+        name : str
+            Column name.
+        values : pandas.Series
+            Numbers or strings.
+
+    Returns:
+        numpy.ndarray
+            Values as float64.
+    """
+    column = COLUMNS_BY_NAME[name]
+
+    if not pd.api.types.is_numeric_dtype(values.dtype):
+        values = values.astype(str)
+        if column.parser == "float":
+            values = values.str.replace(',', '.', n=1, regex=False)
+        values = pd.to_numeric(values, errors='coerce')
+    values = values.to_numpy(np.float64, na_value=np.nan)
+
+    if column.parser == "time":
+        values = np.where((values >= 0) & (values % 100 < 60) & (values // 100 < 24) | (values == column.null),
+                          values, np.nan)
+
+    return values
+
+
+def empty_arrays():
+    """Creates dictionary as 'column name : empty numpy.ndarray' with data types of schema, "str" columns are empty
+    pandas.Categorical.
+
+    Returns:
+        dict of numpy.ndarray
+            'column name : empty numpy.ndarray'
+    """
+    return {column.name: as_column(column.name, np.array([], str if column.parser == "str" else column.dtype))
+            for column in COLUMNS}
+
+
+def pandas_types():
+    """Creates dictionary as 'column name : pandas data type'.
+
+    Returns:
+        dict of (str, str)
+            'column name : pandas data type'
+    """
+    return {column.name: column.pandas for column in COLUMNS}
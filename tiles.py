@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Module containing one class TileCache for drawing basemaps from web map tiles (XYZ scheme, EPSG:3857) under plots
+of geo module, with persistent tile cache on disk.
+
+Tiles are stored in folder as '{z}/{x}/{y}.png'. When size of stored tiles exceeds the limit, least recently used tiles
+are removed. In offline mode tiles are only read from folder (e.g. pre-seeded by seed method or copied from other
+machine), tiles missing in folder are left blank. Stitched images are also kept in memory, so repeated basemaps of the
+same extent don't read nor decode any tile. Each basemap is drawn with attribution of tile provider, as required by
+license of tiles (OpenStreetMap data and CARTO style by default).
+
+Can be imported as module, or run as main script.
+If run as main script, seeds folder with tiles of Czech republic, takes optional arguments:
+    --folder, path to folder with tiles, default=data/tiles,
+    --zoom, zoom levels, default=7 8 9 10.
+
+Out of non-built-in libraries this module uses numpy, matplotlib and requests
+"""
+
+import io
+import math
+import os
+import sys
+import numpy as np
+import matplotlib.image
+import requests
+
+
+class TileCache:
+    """Class for downloading, caching and drawing web map tiles
+
+    Attributes
+        world : float [Class Attribute]
+            Width (and height) of the world in EPSG:3857 meters.
+        url : str [Instance Attribute]
+            Template of tile address with '{z}', '{x}' and '{y}'.
+        folder : str [Instance Attribute]
+            Path to folder with cached tiles.
+        max_bytes : int [Instance Attribute]
+            Limit of total size of cached tiles.
+        offline : bool [Instance Attribute]
+            If true, tiles are never downloaded.
+        max_zoom : int [Instance Attribute]
+            Maximal zoom level of tiles.
+        attribution : str [Instance Attribute]
+            Attribution of tile provider drawn in corner of each basemap.
+        __size : int [Instance Attribute]
+            Total size of cached tiles, None if not counted yet.
+        __images : dict of (tuple, numpy.ndarray) [Instance Attribute]
+            Stitched images as '(url, zoom, x range, y range) : image'.
+    """
+
+    world = 2 * 20037508.342789244
+
+    def __init__(self,
+                 url: str = "https://a.basemaps.cartocdn.com/rastertiles/voyager/{z}/{x}/{y}.png",
+                 folder: str = os.path.join("data", "tiles"),
+                 max_bytes: int = 256 * 1_048_576,
+                 offline: bool = False,
+                 max_zoom: int = 18,
+                 attribution: str = "© OpenStreetMap contributors © CARTO"):
+        """
+        Parameters:
+            url : str
+                Template of tile address with '{z}', '{x}' and '{y}', default is CartoDB Voyager.
+            folder : str
+                Path to folder with cached tiles, created when first tile is saved (not by constructor, so instance
+                can be made on import without touching disk).
+            max_bytes : int
+                Limit of total size of cached tiles in bytes, least recently used tiles are removed above it.
+            offline : bool
+                If true, tiles are only read from folder, missing tiles are left blank.
+            max_zoom : int
+                Maximal zoom level of tiles.
+            attribution : str
+                Attribution of tile provider drawn in corner of each basemap, has to be changed together with url.
+        """
+        self.url = url
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.max_zoom = max_zoom
+        self.attribution = attribution
+        self.__size = None
+        self.__images = {}
+        self.__session = requests.Session()
+        self.__session.headers["User-Agent"] = "izv-geo"
+
+    def __getstate__(self):
+        """Images and session aren't copied to worker processes."""
+        state = self.__dict__.copy()
+        state['_TileCache__images'] = {}
+        del state['_TileCache__session']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.__session = requests.Session()
+        self.__session.headers["User-Agent"] = "izv-geo"
+
+    def zoom(self, bounds: tuple):
+        """Computes zoom level, at which extent is covered by a few tiles.
+
+        Parameters:
+            bounds : tuple of float
+                Extent as (xmin, ymin, xmax, ymax) in EPSG:3857 meters.
+
+        Returns:
+            int
+                Zoom level.
+        """
+        xmin, ymin, xmax, ymax = bounds
+        extent = max(xmax - xmin, ymax - ymin, 1)
+
+        return int(min(max(math.ceil(math.log2(2 * self.world / extent)), 0), self.max_zoom))
+
+    def tile_range(self, bounds: tuple, zoom: int):
+        """Computes tiles covering extent.
+
+        Parameters:
+            bounds : tuple of float
+                Extent as (xmin, ymin, xmax, ymax) in EPSG:3857 meters.
+            zoom : int
+                Zoom level.
+
+        Returns:
+            tuple of (int, int, int, int)
+                First and last x, first and last y of tiles (y grows from north to south).
+        """
+        xmin, ymin, xmax, ymax = bounds
+        count = 2 ** zoom
+        size = self.world / count
+
+        def index(value: float):
+            return min(max(int(math.floor(value / size)), 0), count - 1)
+
+        return (index(xmin + self.world / 2), index(xmax + self.world / 2),
+                index(self.world / 2 - ymax), index(self.world / 2 - ymin))
+
+    def tile_path(self, z: int, x: int, y: int):
+        """Path to tile in folder.
+
+        Parameters:
+            z, x, y : int
+                Zoom level and tile coordinates.
+
+        Returns:
+            str
+                Path to tile.
+        """
+        return os.path.join(self.folder, str(z), str(x), str(y) + '.png')
+
+    def get_tile(self, z: int, x: int, y: int):
+        """Gets tile from folder, or downloads it and saves it to folder (not in offline mode). Reading of cached tile
+        marks it as recently used.
+
+        Parameters:
+            z, x, y : int
+                Zoom level and tile coordinates.
+
+        Returns:
+            bytes
+                PNG data of tile, None if tile isn't available.
+        """
+        path = self.tile_path(z, x, y)
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if not self.offline:
+                os.utime(path)
+            return data
+        except FileNotFoundError:
+            if self.offline:
+                return None
+
+        try:
+            resp = self.__session.get(self.url.format(z=z, x=x, y=y), timeout=30)
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            print('Can\'t download tile: ' + format(e), file=sys.stderr)
+            return None
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(resp.content)
+        os.replace(path + '.tmp', path)
+
+        if self.__size is None:
+            self.__size = self.cache_size()
+        else:
+            self.__size += len(resp.content)
+
+        if self.__size > self.max_bytes:
+            self.evict()
+
+        return resp.content
+
+    def cache_size(self):
+        """Counts total size of tiles in folder.
+
+        Returns:
+            int
+                Size in bytes.
+        """
+        return sum(os.path.getsize(path) for path, _ in self.__tiles())
+
+    def __tiles(self):
+        """Lists tiles in folder.
+
+        Returns:
+            list of tuple of (str, int)
+                Path and modification time in nanoseconds of each tile.
+        """
+        tiles = []
+        for root, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                if filename.endswith('.png'):
+                    path = os.path.join(root, filename)
+                    tiles.append((path, os.stat(path).st_mtime_ns))
+        return tiles
+
+    def evict(self):
+        """Removes least recently used tiles (by modification time), until total size of tiles is under max_bytes."""
+        tiles = sorted(self.__tiles(), key=lambda tile: tile[1])
+        self.__size = sum(os.path.getsize(path) for path, _ in tiles)
+
+        for path, _ in tiles:
+            if self.__size <= self.max_bytes:
+                break
+            self.__size -= os.path.getsize(path)
+            os.remove(path)
+
+    def image(self, bounds: tuple, zoom: int = None):
+        """Stitches tiles covering extent into one image.
+
+        Parameters:
+            bounds : tuple of float
+                Extent as (xmin, ymin, xmax, ymax) in EPSG:3857 meters.
+            zoom : int, optional, default: None
+                Zoom level, if None, it's computed from extent, see zoom method.
+
+        Returns:
+            tuple of (numpy.ndarray, tuple of float)
+                RGBA image (float32) and its extent as (left, right, bottom, top) in EPSG:3857 meters.
+        """
+        if zoom is None:
+            zoom = self.zoom(bounds)
+
+        x0, x1, y0, y1 = self.tile_range(bounds, zoom)
+        size = self.world / 2 ** zoom
+        extent = (x0 * size - self.world / 2, (x1 + 1) * size - self.world / 2,
+                  self.world / 2 - (y1 + 1) * size, self.world / 2 - y0 * size)
+
+        key = (self.url, zoom, x0, x1, y0, y1)
+        if key in self.__images:
+            return self.__images[key], extent
+
+        rows, complete = [], True
+        for y in range(y0, y1 + 1):
+            row = []
+            for x in range(x0, x1 + 1):
+                data = self.get_tile(zoom, x, y)
+                tile = matplotlib.image.imread(io.BytesIO(data), format='png') if data else None
+
+                if tile is None:
+                    # Missing tile is left transparent
+                    tile = np.zeros((256, 256, 4), np.float32)
+                    complete = False
+                elif tile.dtype == np.uint8:
+                    tile = tile.astype(np.float32) / 255
+                if tile.ndim == 2:
+                    tile = np.dstack([tile] * 3)
+                if tile.shape[2] == 3:
+                    tile = np.dstack([tile, np.ones(tile.shape[:2], np.float32)])
+                row.append(tile)
+            rows.append(np.hstack(row))
+
+        image = np.vstack(rows)
+
+        # Image with missing tiles is stitched again next time, unless tiles can't be downloaded anyway
+        if complete or self.offline:
+            self.__images[key] = image
+
+        return image, extent
+
+    def add_basemap(self, ax, zoom: int = None, **kwargs):
+        """Draws basemap under data of axes with attribution of tile provider in lower right corner, axes have to be in
+        EPSG:3857 coordinates. Limits of axes are kept.
+
+        Parameters:
+            ax : matplotlib.axes.Axes
+                Axes.
+            zoom : int, optional, default: None
+                Zoom level, if None, it's computed from extent of axes, see zoom method.
+            kwargs
+                Other arguments of matplotlib.axes.Axes.imshow.
+        """
+        xmin, xmax = ax.get_xlim()
+        ymin, ymax = ax.get_ylim()
+
+        image, extent = self.image((xmin, ymin, xmax, ymax), zoom)
+
+        ax.imshow(image, extent=extent, interpolation=kwargs.pop("interpolation", "bilinear"),
+                  zorder=kwargs.pop("zorder", 0), **kwargs)
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+        ax.text(0.995, 0.005, self.attribution, transform=ax.transAxes, ha="right", va="bottom", fontsize=5,
+                color="#333333", zorder=10, bbox=dict(facecolor="white", alpha=0.7, edgecolor="none", pad=1))
+
+    def seed(self, bounds: tuple, zooms: list):
+        """Downloads all the tiles covering extent at zoom levels, so they can be used in offline mode.
+
+        Parameters:
+            bounds : tuple of float
+                Extent as (xmin, ymin, xmax, ymax) in EPSG:3857 meters.
+            zooms : list of int
+                Zoom levels.
+
+        Returns:
+            int
+                Number of tiles available in folder.
+        """
+        available = 0
+        for zoom in zooms:
+            x0, x1, y0, y1 = self.tile_range(bounds, zoom)
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    available += self.get_tile(zoom, x, y) is not None
+
+        return available
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--folder", default=os.path.join("data", "tiles"))
+    parser.add_argument("--zoom", nargs="+", type=int, default=[7, 8, 9, 10])
+
+    args = parser.parse_args()
+
+    # Czech republic in EPSG:3857
+    print(f'{TileCache(folder=args.folder).seed((1340000, 6200000, 2100000, 6640000), args.zoom)} tiles available')